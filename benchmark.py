@@ -0,0 +1,382 @@
+#!/usr/bin/python3
+
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Benchmarks indexing and analysis on synthetic archives
+# (no mirror or network needed). Each package contains a real shared
+# library built by gcc and an executable which links to it.
+# Libraries are arranged in layers (each depends on libraries from
+# previous layer) and some symbols are defined in all libraries
+# to produce interpositions.
+
+import os
+import os.path
+import io
+import json
+import time
+import random
+import shutil
+import tarfile
+import tempfile
+import argparse
+import platform
+import tracemalloc
+import subprocess
+import concurrent.futures
+
+from lib import database
+from lib import archive
+from lib import elf
+from lib import sink
+from lib.errors import (error, set_prog_name)
+from lib.model import (Package, Object, Symbol, create_schema)
+from lib.bulkload import BulkLoader
+from lib.graph import (Graph, SymbolCache)
+from lib.conflicts import ConflictTable
+from lib.rules import Rules
+import index_packages
+import find_interposes
+
+# Number of packages and exported symbols per library
+scales = {
+  'small' : (20, 200),
+  'medium' : (100, 1000),
+  'large' : (400, 5000),
+}
+
+phases = ['extract', 'parse', 'insert', 'deserialize', 'analysis']
+
+def pkg_name(i):
+  # Fixed width so that names are not prefixes of each other
+  # (otherwise they'd be treated as related packages)
+  return 'bench%04d' % i
+
+def lib_name(i):
+  return 'lib%s.so.1' % pkg_name(i)
+
+def gen_lib_source(i, deps, nsyms, ncommon, nimports):
+  lines = []
+  for dep in deps:
+    for j in range(nimports):
+      lines.append('extern int %s_%d(void);' % (pkg_name(dep), j))
+  for j in range(nsyms):
+    lines.append('int %s_%d(void) { return %d; }' % (pkg_name(i), j, j))
+  # Defined in all libraries
+  for j in range(ncommon):
+    lines.append('int bench_common_%d(void) { return %d; }' % (j, j))
+  calls = ['%s_%d()' % (pkg_name(dep), j) for dep in deps for j in range(nimports)]
+  lines.append('int %s_init(void) { return 0%s; }' % (pkg_name(i), ''.join(' + ' + c for c in calls)))
+  return '\n'.join(lines) + '\n'
+
+def run(cmd, wd):
+  p = subprocess.run(cmd, cwd=wd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  if p.returncode != 0:
+    error("%s failed:\n%s" % (' '.join(cmd), p.stderr.decode()))
+
+def build_package(i, deps, nsyms, ncommon, nimports, build_dir):
+  src = os.path.join(build_dir, '%s.c' % pkg_name(i))
+  with open(src, 'w') as f:
+    f.write(gen_lib_source(i, deps, nsyms, ncommon, nimports))
+  run(['gcc', '-O0', '-shared', '-fPIC', '-Wl,-soname,%s' % lib_name(i),
+       '-o', lib_name(i), src, '-L.', '-Wl,--no-as-needed', '-lc'] + ['-l:%s' % lib_name(dep) for dep in deps],
+      build_dir)
+
+  main = os.path.join(build_dir, '%s_main.c' % pkg_name(i))
+  with open(main, 'w') as f:
+    f.write('extern int %s_init(void);\nint main() { return %s_init(); }\n' % (pkg_name(i), pkg_name(i)))
+  run(['gcc', '-O0', '-o', pkg_name(i), main, '-L.', '-Wl,-rpath-link,.', '-l:%s' % lib_name(i)], build_dir)
+
+def add_tar_member(tar, name, data, mode=0o644):
+  info = tarfile.TarInfo(name)
+  info.size = len(data)
+  info.mode = mode
+  tar.addfile(info, io.BytesIO(data))
+
+def write_deb(path, name, version, files):
+  control = ('Package: %s\nVersion: %s\nArchitecture: amd64\nMaintainer: Nobody <nobody@example.com>\nDescription: synthetic package\n'
+             % (name, version)).encode()
+  control_tar = io.BytesIO()
+  with tarfile.open(fileobj=control_tar, mode='w:gz') as tar:
+    add_tar_member(tar, './control', control)
+  data_tar = io.BytesIO()
+  with tarfile.open(fileobj=data_tar, mode='w:xz') as tar:
+    for member, data, mode in files:
+      add_tar_member(tar, member, data, mode)
+
+  with open(path, 'wb') as f:
+    f.write(archive.AR_MAGIC)
+    for member, data in (('debian-binary', b'2.0\n'),
+                         ('control.tar.gz', control_tar.getvalue()),
+                         ('data.tar.xz', data_tar.getvalue())):
+      f.write(('%-16s%-12d%-6d%-6d%-8o%-10d`\n' % (member, 0, 0, 0, 0o100644, len(data))).encode())
+      f.write(data)
+      if len(data) % 2:
+        f.write(b'\n')
+
+# Generates archive in out_dir and returns paths of .debs
+def generate_archive(out_dir, npkgs, nsyms, depth, overlap, nimports, num_threads, seed):
+  build_dir = os.path.join(out_dir, 'build')
+  deb_dir = os.path.join(out_dir, 'debs')
+  os.makedirs(build_dir)
+  os.makedirs(deb_dir)
+
+  rng = random.Random(seed)
+  ncommon = int(nsyms * overlap)
+  layers = [list(range(l, npkgs, depth)) for l in range(depth)]
+
+  # Libraries in a layer can be built in parallel
+  with concurrent.futures.ThreadPoolExecutor(num_threads) as pool:
+    for l, layer in enumerate(layers):
+      futures = []
+      for i in layer:
+        deps = rng.sample(layers[l - 1], min(3, len(layers[l - 1]))) if l > 0 else []
+        futures.append(pool.submit(build_package, i, deps, nsyms, ncommon, nimports, build_dir))
+      for f in futures:
+        f.result()
+
+  debs = []
+  with open(os.path.join(out_dir, 'pkgs.lst'), 'w') as lst:
+    for i in range(npkgs):
+      name = pkg_name(i)
+      files = []
+      with open(os.path.join(build_dir, lib_name(i)), 'rb') as f:
+        files.append(('./usr/lib/x86_64-linux-gnu/%s' % lib_name(i), f.read(), 0o644))
+      with open(os.path.join(build_dir, name), 'rb') as f:
+        files.append(('./usr/bin/%s' % name, f.read(), 0o755))
+      deb = os.path.join(deb_dir, '%s_1.0_amd64.deb' % name)
+      write_deb(deb, name, '1.0', files)
+      debs.append(deb)
+      lst.write('%s 1.0\n' % name)
+
+  shutil.rmtree(build_dir)
+  return debs
+
+def timed(fun, repeat):
+  best = None
+  for _ in range(repeat):
+    t1 = time.perf_counter()
+    res = fun()
+    t = time.perf_counter() - t1
+    best = t if best is None else min(best, t)
+  return best, res
+
+# Returns result of fun and number of bytes allocated by it
+# which are still alive
+def measure_memory(fun):
+  tracemalloc.start()
+  try:
+    before = tracemalloc.get_traced_memory()[0]
+    res = fun()
+    after = tracemalloc.get_traced_memory()[0]
+  finally:
+    tracemalloc.stop()
+  return res, after - before
+
+def run_benchmark(debs, db_url, work_dir, parser, repeat):
+  times = {}
+  counts = {}
+  # Megabytes per million symbols (i.e. bytes per symbol)
+  memory = {}
+
+  def extract():
+    return [(deb, list(archive.iter_deb_elfs(deb, elf.is_ignored_path))) for deb in debs]
+  times['extract'], elfs = timed(extract, repeat)
+
+  pkgs = []
+  for deb, _ in elfs:
+    name = os.path.basename(deb).split('_')[0]
+    pkgs.append(Package(name, name, '1.0'))
+
+  def parse():
+    pkg_objects = []
+    for pkg, (_, files) in zip(pkgs, elfs):
+      objects = []
+      parsed = {}
+      for f, data, target in files:
+        if target is not None:
+          if target in parsed:
+            objects.append(parsed[target].copy(os.path.basename(f)))
+          continue
+        info = elf.classify(data)
+        if info is not None:
+          obj = parsed[f] = index_packages.elf_parsers[parser](f, data, info, pkg)
+          objects.append(obj)
+      pkg_objects.append(objects)
+    return pkg_objects
+  times['parse'], pkg_objects = timed(parse, repeat)
+  counts['objects'] = sum(len(objs) for objs in pkg_objects)
+  counts['symbols'] = sum(len(obj.imports) + len(obj.exports) for objs in pkg_objects for obj in objs)
+
+  # Symbols are the bulk of parsed data
+  _, size = measure_memory(parse)
+  memory['parsed'] = size / max(counts['symbols'], 1)
+
+  if db_url is None:
+    db_url = 'sqlite://%s' % os.path.join(work_dir, 'bench.db')
+  db = database.open_db(db_url)
+
+  def insert():
+    create_schema(db)
+    conn = db.connect_for_bulk_inserts()
+    loader = BulkLoader(conn)
+    for pkg, objects in zip(pkgs, pkg_objects):
+      loader.add_package(pkg, None, objects)
+    loader.flush()
+    conn.close()
+    return loader.flushed_rows
+  times['insert'], counts['rows'] = timed(insert, repeat)
+
+  conn = db.connect()
+  with conn as cur:
+    Package.create_indices(cur)
+    Object.create_indices(cur)
+    Symbol.create_indices(cur)
+    analyzed_pkgs = Package.deserialize_all(cur)
+  conn.close()
+
+  def deserialize():
+    conn = db.connect(readonly=True)
+    with conn as cur:
+      graph = Graph.load(cur)
+    conn.close()
+    return graph
+  times['deserialize'], graph = timed(deserialize, repeat)
+
+  # Symbols of all objects as loaded for analysis
+  def load_symbols():
+    conn = db.connect(readonly=True)
+    with conn as cur:
+      syms = graph.load_symbols(cur, list(graph.objects.values()))
+    conn.close()
+    return syms
+  syms, size = measure_memory(load_symbols)
+  memory['loaded'] = size / max(sum(len(i) + len(e) for i, e in syms.values()), 1)
+  del syms
+
+  rules = Rules(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ignore_rules.json'))
+
+  def analysis():
+    cache = SymbolCache(graph, 1 << 32)
+    conflicts = ConflictTable(graph, rules, None)
+    results_sink = sink.JsonlSink(os.devnull)
+    worker = find_interposes.Worker(db.connect(readonly=True), results_sink.buffer())
+    for pkg in analyzed_pkgs:
+      find_interposes.find_interposes(pkg, graph, cache, conflicts, None, rules, worker, False)
+    worker.out.flush()
+    worker.conn.close()
+    results_sink.close()
+    return len(conflicts.pairs)
+  times['analysis'], counts['conflicting_pairs'] = timed(analysis, repeat)
+
+  return times, counts, memory
+
+def get_commit():
+  try:
+    p = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+  except OSError:
+    return None
+  return p.stdout.decode().strip() if p.returncode == 0 else None
+
+def compare(old, new):
+  print("%-8s %-12s %10s %10s %8s" % ('Scale', 'Phase', 'Old', 'New', 'Ratio'))
+  for scale, res in new['scales'].items():
+    old_res = old['scales'].get(scale)
+    if old_res is None:
+      continue
+    for phase in phases:
+      t_old = old_res['times'].get(phase)
+      t_new = res['times'].get(phase)
+      if t_old is None or t_new is None:
+        continue
+      print("%-8s %-12s %10.3f %10.3f %7.2fx" % (scale, phase, t_old, t_new, t_new / t_old if t_old else 0))
+    for kind, m_new in sorted(res.get('memory', {}).items()):
+      m_old = old_res.get('memory', {}).get(kind)
+      if m_old is None:
+        continue
+      print("%-8s %-12s %10.1f %10.1f %7.2fx" % (scale, 'mem:' + kind, m_old, m_new, m_new / m_old if m_old else 0))
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark indexing and analysis on synthetic archives.")
+  parser.add_argument('--scales', help="Comma-separated list of scales: %s (default: %%(default)s)." % ', '.join(scales), default='small,medium')
+  parser.add_argument('--symbols', help="Override number of exported symbols per library.", type=int, default=None)
+  parser.add_argument('--depth', help="Number of library layers (default: %(default)s).", type=int, default=3)
+  parser.add_argument('--overlap', help="Fraction of symbols defined in all libraries (default: %(default)s).", type=float, default=0.05)
+  parser.add_argument('--imports', help="Number of symbols imported from each dependency (default: %(default)s).", type=int, default=10)
+  parser.add_argument('--elf-parser', help="ELF parser (default: %(default)s).", choices=sorted(index_packages.elf_parsers.keys()), default='raw')
+  parser.add_argument('--db-url', help="Database to benchmark (WILL BE DROPPED; default is a temporary SQLite database).", default=None)
+  parser.add_argument('--repeat', help="Run each phase N times and report best time (default: %(default)s).", type=int, default=1)
+  parser.add_argument('-j', dest='num_threads', help="Number of threads for building libraries.", type=int, default=os.cpu_count())
+  parser.add_argument('--seed', help="Random seed (default: %(default)s).", type=int, default=0)
+  parser.add_argument('--work-dir', help="Directory for generated archives (default is a temporary directory).", default=None)
+  parser.add_argument('--keep', dest='keep', help="Do not remove generated archives.", default=False, action='store_true')
+  parser.add_argument('--no-keep', dest='keep', help="Remove generated archives.", action='store_false')
+  parser.add_argument('--output', '-o', metavar='FILE', help="Save results as JSON to FILE.", default=None)
+  parser.add_argument('--compare', metavar='FILE', help="Compare results with earlier ones from FILE.", default=None)
+
+  args = parser.parse_args()
+
+  set_prog_name(os.path.basename(__file__))
+
+  if args.elf_parser != 'raw' and index_packages.ELFFile is None:
+    error("pyelftools is not installed (use --elf-parser=raw)")
+
+  work_dir = args.work_dir or tempfile.mkdtemp(prefix='interpose-bench-')
+  results = {
+    'commit' : get_commit(),
+    'date' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'python' : platform.python_version(),
+    'elf_parser' : args.elf_parser,
+    'scales' : {},
+  }
+
+  try:
+    for scale in args.scales.split(','):
+      if scale not in scales:
+        error("unknown scale '%s'" % scale)
+      npkgs, nsyms = scales[scale]
+      if args.symbols is not None:
+        nsyms = args.symbols
+      params = {'packages' : npkgs, 'symbols' : nsyms, 'depth' : args.depth,
+                'overlap' : args.overlap, 'imports' : args.imports}
+
+      scale_dir = os.path.join(work_dir, scale)
+      if os.path.exists(scale_dir):
+        shutil.rmtree(scale_dir)
+      os.makedirs(scale_dir)
+
+      t1 = time.perf_counter()
+      debs = generate_archive(scale_dir, npkgs, nsyms, args.depth, args.overlap,
+                              args.imports, args.num_threads, args.seed)
+      gen_time = time.perf_counter() - t1
+
+      times, counts, memory = run_benchmark(debs, args.db_url, scale_dir, args.elf_parser, args.repeat)
+      results['scales'][scale] = {'params' : params, 'times' : times, 'counts' : counts, 'memory' : memory}
+
+      print("Scale %s (%d packages, %d symbols per library, generated in %.1f sec.):"
+            % (scale, npkgs, nsyms, gen_time))
+      for phase in phases:
+        print("  %-12s %.3f sec." % (phase, times[phase]))
+      print("  %s" % ', '.join('%s = %d' % kv for kv in sorted(counts.items())))
+      print("  memory per million symbols: %s" % ', '.join('%s %.1f MB' % kv for kv in sorted(memory.items())))
+  finally:
+    if not args.keep and args.work_dir is None:
+      shutil.rmtree(work_dir)
+
+  if args.output is not None:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+      f.write('\n')
+
+  if args.compare is not None:
+    with open(args.compare) as f:
+      old = json.load(f)
+    compare(old, results)
+
+if __name__ == '__main__':
+  main()
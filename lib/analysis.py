@@ -1,3 +1,6 @@
+import math
+import heapq
+
 def mean(x):
   x = list(x)
   return sum(x) / len(x) if x else 0
@@ -8,3 +11,126 @@ def median(x):
   if rem:
     return x[quot]
   return sum(x[quot - 1:quot + 1]) / 2.
+
+# Streaming histogram with logarithmic buckets: uses fixed memory
+# and percentiles are accurate to BUCKETS_PER_OCTAVE resolution
+# (about 9%). Histograms from different workers can be merged.
+class Histogram:
+  __slots__ = ['counts', 'count', 'total', 'min', 'max']
+
+  # Covers 1 usec .. 2^40 usec (~12 days)
+  MIN_VALUE = 1e-6
+  BUCKETS_PER_OCTAVE = 8
+  NUM_BUCKETS = 40 * BUCKETS_PER_OCTAVE + 1
+
+  def __init__(self):
+    self.counts = [0] * Histogram.NUM_BUCKETS
+    self.count = 0
+    self.total = 0
+    self.min = None
+    self.max = None
+
+  @classmethod
+  def bucket(cls, x):
+    if x <= cls.MIN_VALUE:
+      return 0
+    b = int(math.log2(x / cls.MIN_VALUE) * cls.BUCKETS_PER_OCTAVE) + 1
+    return min(b, cls.NUM_BUCKETS - 1)
+
+  # Upper bound of values in bucket
+  @classmethod
+  def bucket_limit(cls, b):
+    return cls.MIN_VALUE * 2 ** (b / cls.BUCKETS_PER_OCTAVE)
+
+  def add(self, x):
+    self.counts[Histogram.bucket(x)] += 1
+    self.count += 1
+    self.total += x
+    self.min = x if self.min is None else min(self.min, x)
+    self.max = x if self.max is None else max(self.max, x)
+
+  def merge(self, other):
+    for b, n in enumerate(other.counts):
+      self.counts[b] += n
+    self.count += other.count
+    self.total += other.total
+    if other.count:
+      self.min = other.min if self.min is None else min(self.min, other.min)
+      self.max = other.max if self.max is None else max(self.max, other.max)
+
+  def mean(self):
+    return self.total / self.count if self.count else 0
+
+  # p is in [0, 100]
+  def percentile(self, p):
+    if not self.count:
+      return 0
+    rank = max(1, math.ceil(self.count * p / 100.))
+    seen = 0
+    for b, n in enumerate(self.counts):
+      seen += n
+      if seen >= rank:
+        return max(self.min, min(self.max, Histogram.bucket_limit(b)))
+    return self.max
+
+  def __str__(self):
+    return "p50 %g, p90 %g, p99 %g, max %g (mean %g, total %g)" \
+      % (self.percentile(50), self.percentile(90), self.percentile(99),
+         self.max or 0, self.mean(), self.total)
+
+# Keeps N largest values with their labels
+class Slowest:
+  __slots__ = ['n', 'heap']
+
+  def __init__(self, n=10):
+    self.n = n
+    self.heap = []
+
+  def add(self, x, label):
+    if len(self.heap) < self.n:
+      heapq.heappush(self.heap, (x, label))
+    elif x > self.heap[0][0]:
+      heapq.heapreplace(self.heap, (x, label))
+
+  def merge(self, other):
+    for x, label in other.heap:
+      self.add(x, label)
+
+  # Returns (value, label) pairs, largest first
+  def items(self):
+    return sorted(self.heap, reverse=True)
+
+# Summary of per-item stats collected by worker as items are processed:
+# histograms of timing fields, slowest items (by first field)
+# and totals of counters. Uses fixed memory and summaries
+# of different workers (or processes) can be merged.
+class Summary:
+  __slots__ = ['fields', 'label', 'counters', 'count', 'hists', 'slowest', 'totals']
+
+  def __init__(self, fields, label, counters=()):
+    self.fields = fields
+    self.label = label
+    self.counters = counters
+    self.count = 0
+    self.hists = {field : Histogram() for field in fields}
+    self.slowest = Slowest()
+    self.totals = {counter : 0 for counter in counters}
+
+  def add(self, r):
+    self.count += 1
+    for field in self.fields:
+      self.hists[field].add(getattr(r, field))
+    self.slowest.add(getattr(r, self.fields[0]), getattr(r, self.label))
+    for counter in self.counters:
+      self.totals[counter] += getattr(r, counter)
+
+  def merge(self, other):
+    self.count += other.count
+    for field in self.fields:
+      self.hists[field].merge(other.hists[field])
+    self.slowest.merge(other.slowest)
+    for counter in self.counters:
+      self.totals[counter] += other.totals[counter]
+
+def format_duration(secs):
+  return "%d:%02d" % (secs / 60, secs % 60)
@@ -0,0 +1,180 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Metadata from APT index files (Packages and Sources files
+# in /var/lib/apt/lists or in a mirror), parsed once
+# instead of querying apt-cache for each package.
+
+import os
+import os.path
+import glob
+import gzip
+import lzma
+
+from lib.errors import (warn, Error)
+
+openers = {
+  '' : open,
+  '.gz' : gzip.open,
+  '.xz' : lzma.open,
+}
+
+def get_compression(path):
+  ext = os.path.splitext(path)[1]
+  return ext if ext in openers else None
+
+# Iterates over stanzas of Debian control file, only collecting given fields
+def iter_stanzas(lines, fields):
+  stanza = {}
+  key = None
+  for line in lines:
+    if line[0] in ' \t':
+      # Continuation of multi-line field
+      if key is not None:
+        stanza[key] += ' ' + line.strip()
+      continue
+    line = line.rstrip('\n')
+    if not line:
+      if stanza:
+        yield stanza
+      stanza = {}
+      key = None
+      continue
+    key, _, value = line.partition(':')
+    if key in fields:
+      stanza[key] = value.strip()
+    else:
+      key = None
+  if stanza:
+    yield stanza
+
+def iter_index(path, fields):
+  opener = openers[get_compression(path)]
+  try:
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+      yield from iter_stanzas(f, fields)
+  except (OSError, EOFError, lzma.LZMAError) as e:
+    raise Error("failed to read %s: %s" % (path, e))
+
+# Source field may contain version: "Source: name (version)",
+# if it's missing source has the same name as binary
+def get_source(stanza, name):
+  return stanza.get('Source', name).split(' ')[0]
+
+# Returns source package name from contents of control file
+def get_control_source(control, name):
+  for stanza in iter_stanzas(control.splitlines(True), {'Source'}):
+    return get_source(stanza, name)
+  return name
+
+class BinaryPackage:
+  __slots__ = ['name', 'source', 'version', 'filename', 'size', 'installed_size']
+
+  def __init__(self, name, source, version, filename, size, installed_size):
+    self.name = name
+    self.source = source
+    self.version = version
+    # Relative to root of mirror
+    self.filename = filename
+    self.size = size
+    # In kilobytes
+    self.installed_size = installed_size
+
+  def __str__(self):
+    return "%s %s (source %s): %s" % (self.name, self.version, self.source, self.filename)
+
+binary_fields = {'Package', 'Source', 'Version', 'Filename', 'Size', 'Installed-Size'}
+source_fields = {'Package', 'Binary'}
+
+def to_int(s):
+  try:
+    return int(s)
+  except (TypeError, ValueError):
+    return None
+
+class Index:
+  def __init__(self):
+    # Binary package name -> list of BinaryPackage
+    # (there may be several versions or architectures)
+    self.binaries = {}
+    # Binary package name -> source package name
+    # (from Sources files, for packages which are missing in Packages)
+    self.sources = {}
+
+  def load(self, lists_dir):
+    for kind, load in (('Packages', self.load_packages), ('Sources', self.load_sources)):
+      for path in sorted(glob.glob(os.path.join(lists_dir, '*_%s*' % kind))):
+        if get_compression(path) is None:
+          warn("%s: unsupported compression, skipping" % path)
+          continue
+        load(path)
+
+  def load_packages(self, path):
+    for s in iter_index(path, binary_fields):
+      name = s.get('Package')
+      if name is None:
+        continue
+      info = BinaryPackage(name, get_source(s, name), s.get('Version'), s.get('Filename'),
+                           to_int(s.get('Size')), to_int(s.get('Installed-Size')))
+      self.binaries.setdefault(name, []).append(info)
+
+  def load_sources(self, path):
+    for s in iter_index(path, source_fields):
+      source = s.get('Package')
+      if source is None:
+        continue
+      for name in s.get('Binary', '').split(','):
+        name = name.strip()
+        if name:
+          self.sources.setdefault(name, source)
+
+  def __len__(self):
+    return len(self.binaries)
+
+  # Returns BinaryPackage for given version (or first found one
+  # if version is not given) or None
+  def lookup(self, name, version=None):
+    lst = self.binaries.get(name)
+    if not lst:
+      return None
+    if version is None:
+      return lst[0]
+    for info in lst:
+      if info.version == version:
+        return info
+    return None
+
+  def get_source_name(self, name):
+    info = self.lookup(name)
+    if info is not None:
+      return info.source
+    return self.sources.get(name)
+
+  # Returns path to .deb in local pool/mirror or None
+  def find_deb(self, pool_dir, name, version=None):
+    info = self.lookup(name, version)
+    if info is None:
+      if version is not None and name in self.binaries:
+        warn("version %s of package %s not found in APT index (available: %s)"
+             % (version, name, ', '.join(str(other.version) for other in self.binaries[name])))
+      return None
+    if info.filename is None:
+      return None
+    # Pool may be a mirror root or just a flat folder with .debs
+    for path in (os.path.join(pool_dir, info.filename),
+                 os.path.join(pool_dir, os.path.basename(info.filename))):
+      if os.path.isfile(path):
+        return path
+    return None
+
+def load_index(lists_dir):
+  index = Index()
+  if not os.path.isdir(lists_dir):
+    warn("APT lists folder %s not found" % lists_dir)
+    return index
+  index.load(lists_dir)
+  return index
@@ -0,0 +1,129 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Streaming reader for .deb packages: walks ar archive and data tarball
+# member by member without unpacking anything to disk.
+
+import io
+import os.path
+import tarfile
+import zlib
+import lzma
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+from lib.errors import Error
+
+AR_MAGIC = b'!<arch>\n'
+AR_HEADER_SIZE = 60
+ELF_MAGIC = b'\x7fELF'
+
+# Read-only view of a slice of underlying stream
+class ArMember(io.RawIOBase):
+  def __init__(self, stream, size):
+    self.stream = stream
+    self.left = size
+
+  def readable(self):
+    return True
+
+  def readinto(self, b):
+    n = min(len(b), self.left)
+    if n == 0:
+      return 0
+    data = self.stream.read(n)
+    b[:len(data)] = data
+    self.left -= len(data)
+    return len(data)
+
+  def skip(self):
+    self.stream.seek(self.left, io.SEEK_CUR)
+    self.left = 0
+
+def normalize_path(name):
+  return '/' + os.path.normpath(name).lstrip('/')
+
+def iter_ar_members(stream, path):
+  if stream.read(len(AR_MAGIC)) != AR_MAGIC:
+    raise Error("%s: not an ar archive" % path)
+  while True:
+    hdr = stream.read(AR_HEADER_SIZE)
+    if not hdr:
+      break
+    if len(hdr) != AR_HEADER_SIZE or hdr[58:60] != b'`\n':
+      raise Error("%s: malformed ar header" % path)
+    name = hdr[0:16].decode().strip().rstrip('/')
+    size = int(hdr[48:58].decode())
+    member = ArMember(stream, size)
+    yield name, member
+    member.skip()
+    if size % 2:
+      stream.read(1)
+
+def open_data_tar(name, member, path):
+  if name.endswith('.zst'):
+    if zstandard is None:
+      raise Error("%s: zstandard module is needed to unpack %s" % (path, name))
+    return tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(member), mode='r|')
+  _, ext = os.path.splitext(name)
+  comp = {'.gz' : 'gz', '.xz' : 'xz', '.lzma' : 'xz', '.bz2' : 'bz2', '.tar' : ''}.get(ext)
+  if comp is None:
+    raise Error("%s: unsupported compression of %s" % (path, name))
+  return tarfile.open(fileobj=io.BufferedReader(member), mode='r|' + comp)
+
+# Returns contents of control file of package
+def read_deb_control(path):
+  with open(path, 'rb') as stream:
+    for name, member in iter_ar_members(stream, path):
+      if not name.startswith('control.tar'):
+        continue
+      try:
+        with open_data_tar(name, member, path) as tar:
+          for info in tar:
+            if normalize_path(info.name) == '/control' and info.isreg():
+              return tar.extractfile(info).read().decode('utf-8', errors='replace')
+      except (tarfile.TarError, EOFError, zlib.error, lzma.LZMAError) as e:
+        raise Error("%s: failed to unpack %s: %s" % (path, name, e))
+      break
+  raise Error("%s: no control file in package" % path)
+
+# Yields (path, contents, link_target) for all ELF files in package
+# (except those rejected by is_ignored(path)). For hardlinks to
+# earlier ELFs contents is None and link_target is path of target.
+def iter_deb_elfs(path, is_ignored=None):
+  with open(path, 'rb') as stream:
+    for name, member in iter_ar_members(stream, path):
+      if not name.startswith('data.tar'):
+        continue
+      try:
+        # Hardlinks refer to earlier members
+        elfs = set()
+        with open_data_tar(name, member, path) as tar:
+          for info in tar:
+            f = normalize_path(info.name)
+            if is_ignored is not None and is_ignored(f):
+              continue
+            if info.islnk():
+              target = normalize_path(info.linkname)
+              if target in elfs:
+                yield f, None, target
+              continue
+            if not info.isreg():
+              continue
+            contents = tar.extractfile(info)
+            header = contents.read(len(ELF_MAGIC))
+            if header != ELF_MAGIC:
+              continue
+            elfs.add(f)
+            yield f, header + contents.read(), None
+      except (tarfile.TarError, EOFError, zlib.error, lzma.LZMAError) as e:
+        raise Error("%s: failed to unpack %s: %s" % (path, name, e))
+      return
+  raise Error("%s: no data archive in package" % path)
@@ -0,0 +1,112 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+import datetime
+
+from lib import database
+from lib import trace
+from lib.errors import warn
+from lib.model import (serialized_columns, shared_tables, NameTable)
+
+# Buffers rows of many packages and writes them in large batches.
+# Object and package IDs are allocated on client side from
+# per-loader blocks so no round trips are needed to get them.
+class BulkLoader:
+  def __init__(self, conn, load_data=False, max_rows=100000, id_block=1024):
+    self.conn = conn
+    self.load_data = load_data
+    self.max_rows = max_rows
+    self.id_block = id_block
+    self.ids = {}
+    self.rows = {table : [] for table, _ in serialized_columns}
+    self.nrows = 0
+    self.names = NameTable()
+    # Packages in current batch
+    self.pkgs = []
+    # Packages whose batch failed to commit (see take_failed)
+    self.failed = []
+
+    self.flushed_rows = 0
+    self.flush_time = 0
+
+  def alloc_id(self, table):
+    next_id, end = self.ids.get(table, (0, 0))
+    if next_id == end:
+      next_id = database.reserve_ids(self.conn, table, self.id_block)
+      end = next_id + self.id_block
+    self.ids[table] = (next_id + 1, end)
+    return next_id
+
+  # Returns number of rows generated for package
+  def add_package(self, pkg, error_msg, objects):
+    sizes = {table : len(rows) for table, rows in self.rows.items()}
+    try:
+      with trace.span('serialize', 'db', pkg=pkg.name):
+        pkg.id = self.alloc_id('Packages')
+        for obj in objects:
+          obj.id = self.alloc_id('Objects')
+          obj.serialize_rows(self.rows, pkg.id, self.names)
+        pkg.serialize_rows(self.rows, error_msg)
+    except database.db_errors as e:
+      # IDs could not be reserved so drop rows of package
+      # (they are interleaved with rows of other packages)
+      name_rows = self.rows['SymbolNames'][sizes['SymbolNames']:]
+      for table, rows in self.rows.items():
+        del rows[sizes[table]:]
+      self.drop_packages([pkg], name_rows, e)
+      return 0
+    self.pkgs.append(pkg)
+    nrows = sum(len(rows) for rows in self.rows.values())
+    added = nrows - self.nrows
+    self.nrows = nrows
+    if self.nrows >= self.max_rows:
+      self.flush()
+    return added
+
+  # Writes all buffered rows in one transaction. If it fails, whole batch
+  # is dropped (rows of half-written batch would refer to missing rows
+  # of other tables) and its packages are reported via take_failed
+  # (they are not in DB so --incremental will reindex them).
+  # Packages whose IDs can not be reserved are dropped in the same way.
+  def flush(self):
+    if not self.nrows:
+      return
+    all_rows, self.rows = self.rows, {table : [] for table, _ in serialized_columns}
+    nrows, self.nrows = self.nrows, 0
+    pkgs, self.pkgs = self.pkgs, []
+    t1 = datetime.datetime.now()
+    try:
+      with trace.span('flush', 'db', rows=nrows), self.conn as cur:
+        for table, columns in serialized_columns:
+          rows = all_rows[table]
+          if not rows:
+            continue
+          ignore = table in shared_tables
+          if self.load_data:
+            database.load_rows(cur, table, columns, rows, ignore)
+          else:
+            database.insert_rows(cur, table, columns, rows, ignore)
+    except database.db_errors as e:
+      self.drop_packages(pkgs, all_rows['SymbolNames'], e)
+      return
+    t2 = datetime.datetime.now()
+    self.flushed_rows += nrows
+    self.flush_time += (t2 - t1).total_seconds()
+
+  # Marks packages whose rows were dropped as failed
+  # and forgets names which were not written
+  def drop_packages(self, pkgs, name_rows, e):
+    warn("failed to store %d packages (%s): %s" % (len(pkgs), ', '.join(pkg.name for pkg in pkgs), e))
+    for pkg in pkgs:
+      pkg.has_errors = True
+    self.failed += pkgs
+    self.names.forget(name_rows)
+
+  # Returns packages which were lost in failed flushes since last call
+  def take_failed(self):
+    failed, self.failed = self.failed, []
+    return failed
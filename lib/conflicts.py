@@ -0,0 +1,78 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Table of duplicate definitions for ordered pairs of objects.
+# Result for a pair does not depend on executable which loads it
+# so it is computed once and optionally saved to file
+# (tagged with database generation and rules) for later runs.
+
+import os
+import os.path
+import pickle
+import tempfile
+import threading
+
+class ConflictTable:
+  def __init__(self, graph, rules, key, track_new=False):
+    self.graph = graph
+    self.rules = rules
+    self.key = key
+    self.lock = threading.Lock()
+    self.pairs = {}
+    # Pairs computed since last take_new() (only if track_new is set)
+    self.new_pairs = {} if track_new else None
+    self.nloaded = 0
+
+  # Returns symbols of obj which duplicate symbols of other_obj
+  # (loaded before it) and are not ignored
+  def get(self, other_obj, obj):
+    pair = other_obj.id, obj.id
+    name_ids = self.pairs.get(pair)
+    syms = self.graph.multi_defs[obj.id]
+    if name_ids is None:
+      other_syms = self.graph.multi_defs[other_obj.id]
+      mask = self.rules.get_duplicate_mask(obj, other_obj)
+      name_ids = tuple(name_id for name_id, sym in syms.items()
+                       if name_id in other_syms and not self.rules.can_ignore_duplicate(sym, mask))
+      with self.lock:
+        self.pairs[pair] = name_ids
+        if self.new_pairs is not None:
+          self.new_pairs[pair] = name_ids
+    return [syms[name_id] for name_id in name_ids]
+
+  # Returns pairs computed since last call
+  # (needed to collect results from worker processes)
+  def take_new(self):
+    with self.lock:
+      new_pairs = self.new_pairs
+      self.new_pairs = {} if new_pairs is not None else None
+    return new_pairs
+
+  def update(self, pairs):
+    with self.lock:
+      self.pairs.update(pairs)
+
+  # Loads table unless it was computed for different key
+  def load(self, path):
+    try:
+      with open(path, 'rb') as stream:
+        key, pairs = pickle.load(stream)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+      return
+    if key is None or key != self.key:
+      return
+    self.pairs.update(pairs)
+    self.nloaded = len(pairs)
+
+  def save(self, path):
+    if self.key is None:
+      return
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+    with os.fdopen(fd, 'wb') as stream:
+      pickle.dump((self.key, self.pairs), stream, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
@@ -0,0 +1,296 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Lightweight ELF helpers which do not need pyelftools.
+
+import re
+import struct
+
+ELF_MAGIC = b'\x7fELF'
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+ET_EXEC = 2
+ET_DYN = 3
+
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+DF_1_PIE = 0x08000000
+
+# Files in these locations never contain interesting ELFs
+# (debuginfo, kernel modules, data).
+ignored_path_re = re.compile(r'^/(?:usr/lib/debug|usr/share|lib/modules|usr/lib/modules|lib/firmware|usr/lib/firmware)/|\.(?:ko|o|a|debug)$')
+
+def is_ignored_path(f):
+  return ignored_path_re.search(f) is not None
+
+class ElfInfo:
+  __slots__ = ['elfclass', 'endian', 'type', 'machine', 'has_dynamic', 'has_interp']
+
+  def __init__(self, elfclass, endian, type, machine, has_dynamic, has_interp):
+    self.elfclass = elfclass
+    self.endian = endian
+    self.type = type
+    self.machine = machine
+    self.has_dynamic = has_dynamic
+    self.has_interp = has_interp
+
+  def __repr__(self):
+    return 'ELF%d %s type %d machine %d%s%s' % (
+      32 if self.elfclass == ELFCLASS32 else 64,
+      'LSB' if self.endian == '<' else 'MSB',
+      self.type, self.machine,
+      ' dynamic' if self.has_dynamic else '',
+      ' interp' if self.has_interp else '')
+
+# Returns ElfInfo for dynamically linked executables and libraries
+# and None for everything else (non-ELFs, static binaries, object files).
+def classify(data):
+  if len(data) < 64 or data[:4] != ELF_MAGIC:
+    return None
+  elfclass = data[4]
+  endian = {ELFDATA2LSB : '<', ELFDATA2MSB : '>'}.get(data[5])
+  if endian is None or elfclass not in (ELFCLASS32, ELFCLASS64):
+    return None
+
+  try:
+    type, machine = struct.unpack_from(endian + 'HH', data, 16)
+    if type not in (ET_EXEC, ET_DYN):
+      return None
+
+    if elfclass == ELFCLASS64:
+      phoff, = struct.unpack_from(endian + 'Q', data, 32)
+      phentsize, phnum = struct.unpack_from(endian + 'HH', data, 54)
+    else:
+      phoff, = struct.unpack_from(endian + 'I', data, 28)
+      phentsize, phnum = struct.unpack_from(endian + 'HH', data, 42)
+
+    has_dynamic = has_interp = False
+    for i in range(phnum):
+      p_type, = struct.unpack_from(endian + 'I', data, phoff + i * phentsize)
+      if p_type == PT_DYNAMIC:
+        has_dynamic = True
+      elif p_type == PT_INTERP:
+        has_interp = True
+  except struct.error:
+    # Truncated file
+    return None
+
+  if not has_dynamic:
+    return None
+
+  return ElfInfo(elfclass, endian, type, machine, has_dynamic, has_interp)
+
+# PIEs are ET_DYN too: tell them apart by DF_1_PIE or, for older
+# toolchains, by presence of interpreter. Libraries like libc.so.6
+# also have PT_INTERP but they always have DT_SONAME.
+def is_shlib(info, soname, flags_1):
+  if info.type != ET_DYN or (flags_1 & DF_1_PIE):
+    return False
+  return not info.has_interp or soname is not None
+
+SHT_RELA = 4
+SHT_DYNAMIC = 6
+SHT_REL = 9
+SHT_DYNSYM = 11
+
+SHN_UNDEF = 0
+
+STB_GLOBAL = 1
+STB_WEAK = 2
+STB_GNU_UNIQUE = 10
+
+STV_DEFAULT = 0
+STV_PROTECTED = 3
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_SONAME = 14
+DT_SYMBOLIC = 16
+DT_FLAGS = 30
+DT_FLAGS_1 = 0x6ffffffb
+
+DF_SYMBOLIC = 0x2
+
+EM_SPARC = 2
+EM_386 = 3
+EM_68K = 4
+EM_MIPS = 8
+EM_PARISC = 15
+EM_PPC = 20
+EM_PPC64 = 21
+EM_S390 = 22
+EM_ARM = 40
+EM_SH = 42
+EM_SPARCV9 = 43
+EM_X86_64 = 62
+EM_AARCH64 = 183
+EM_RISCV = 243
+EM_LOONGARCH = 258
+EM_ALPHA = 0x9026
+
+# R_*_COPY for each machine
+copy_reloc_types = {
+  EM_SPARC : 19,
+  EM_386 : 5,
+  EM_68K : 19,
+  EM_MIPS : 126,
+  EM_PARISC : 128,
+  EM_PPC : 19,
+  EM_PPC64 : 19,
+  EM_S390 : 9,
+  EM_ARM : 20,
+  EM_SH : 162,
+  EM_SPARCV9 : 19,
+  EM_X86_64 : 5,
+  EM_AARCH64 : 1024,
+  EM_RISCV : 4,
+  EM_LOONGARCH : 4,
+  EM_ALPHA : 24,
+}
+
+# Like struct.iter_unpack but ignores trailing garbage
+def iter_unpack(fmt, data):
+  size = struct.calcsize(fmt)
+  n = len(data) - len(data) % size
+  return struct.iter_unpack(fmt, data[:n])
+
+class Section:
+  __slots__ = ['name', 'type', 'offset', 'size', 'link', 'info', 'entsize']
+
+  def __init__(self, name, type, offset, size, link, info, entsize):
+    self.name = name
+    self.type = type
+    self.offset = offset
+    self.size = size
+    self.link = link
+    self.info = info
+    self.entsize = entsize
+
+# Minimal ELF reader which decodes tables in bulk via struct
+# (an order of magnitude faster than pyelftools on large libraries).
+# Data may be bytes or mmap.
+class ElfFile:
+  def __init__(self, data, info):
+    self.data = data
+    self.info = info
+    self.is64 = info.elfclass == ELFCLASS64
+    e = info.endian
+    if self.is64:
+      shoff, = struct.unpack_from(e + 'Q', data, 40)
+      shentsize, shnum, shstrndx = struct.unpack_from(e + 'HHH', data, 58)
+      shdr_fmt = e + 'IIQQQQIIQQ'
+    else:
+      shoff, = struct.unpack_from(e + 'I', data, 32)
+      shentsize, shnum, shstrndx = struct.unpack_from(e + 'HHH', data, 46)
+      shdr_fmt = e + 'IIIIIIIIII'
+
+    shdrs = [struct.unpack_from(shdr_fmt, data, shoff + i * shentsize) for i in range(shnum)]
+    self.sections = []
+    for name, type, _, _, offset, size, link, info, _, entsize in shdrs:
+      self.sections.append(Section(name, type, offset, size, link, info, entsize))
+    if shstrndx < len(self.sections):
+      shstrtab = self.sections[shstrndx]
+      for sec in self.sections:
+        sec.name = self.get_string(shstrtab, sec.name)
+    self.sections_by_name = {sec.name : sec for sec in self.sections}
+
+  def get_section_by_name(self, name):
+    return self.sections_by_name.get(name)
+
+  def get_section_data(self, sec):
+    return self.data[sec.offset:sec.offset + sec.size]
+
+  def get_string(self, strtab, offset):
+    start = strtab.offset + offset
+    end = self.data.find(b'\0', start, strtab.offset + strtab.size)
+    if end == -1:
+      end = strtab.offset + strtab.size
+    return self.data[start:end].decode('utf-8', errors='replace')
+
+  # Returns list of (d_tag, d_val) up to DT_NULL
+  def get_dynamic_tags(self, dynsect):
+    fmt = self.info.endian + ('qQ' if self.is64 else 'iI')
+    tags = []
+    for tag, val in iter_unpack(fmt, self.get_section_data(dynsect)):
+      if tag == DT_NULL:
+        break
+      tags.append((tag, val))
+    return tags
+
+  # Returns list of (st_name, st_info, st_other, st_shndx, st_value)
+  def get_symbols(self, symtab):
+    data = self.get_section_data(symtab)
+    if self.is64:
+      return [(name, info, other, shndx, value)
+              for name, info, other, shndx, value, _ in iter_unpack(self.info.endian + 'IBBHQQ', data)]
+    else:
+      return [(name, info, other, shndx, value)
+              for name, value, _, info, other, shndx in iter_unpack(self.info.endian + 'IIIBBH', data)]
+
+  # Returns names of version definitions
+  def get_verdef_names(self, verdef):
+    e = self.info.endian
+    strtab = self.sections[verdef.link]
+    names = set()
+    off = verdef.offset
+    for i in range(verdef.info):
+      _, _, _, _, _, vd_aux, vd_next = struct.unpack_from(e + 'HHHHIII', self.data, off)
+      vda_name, _ = struct.unpack_from(e + 'II', self.data, off + vd_aux)
+      names.add(self.get_string(strtab, vda_name))
+      if not vd_next:
+        break
+      off += vd_next
+    return names
+
+  # Returns target addresses of copy relocations
+  # (from both REL and RELA dynamic relocation sections).
+  def get_copy_relocs(self):
+    addresses = set()
+    copy_type = copy_reloc_types.get(self.info.machine)
+    if copy_type is None:
+      return addresses
+    symtab = self.get_section_by_name('.dynsym')
+    wordsize = 8 if self.is64 else 4
+    if not self.is64:
+      get_type = lambda info: info & 0xff
+      # Index of lowest byte of r_type in little-endian r_info
+      type_byte = 0
+    elif self.info.machine == EM_MIPS and self.info.endian == '<':
+      # Little-endian MIPS64 stores r_sym first and r_type last
+      get_type = lambda info: info >> 56
+      type_byte = 7
+    else:
+      get_type = lambda info: info & 0xffffffff
+      type_byte = 0
+    if self.info.endian == '>':
+      type_byte = wordsize - 1 - type_byte
+    fmt = self.info.endian + ('QQ' if self.is64 else 'II')
+    key = copy_type & 0xff
+    for sec in self.sections:
+      if sec.type not in (SHT_REL, SHT_RELA) \
+          or symtab is None or self.sections[sec.link] is not symtab \
+          or sec.name.endswith('.plt'):
+        continue
+      data = self.get_section_data(sec)
+      entsize = (3 if sec.type == SHT_RELA else 2) * wordsize
+      end = len(data) - len(data) % entsize
+      # Search lowest bytes of r_types of all relocations at once
+      # and only decode those which may match
+      type_bytes = data[wordsize + type_byte:end:entsize]
+      i = type_bytes.find(key)
+      while i != -1:
+        off, info = struct.unpack_from(fmt, data, i * entsize)
+        if get_type(info) == copy_type:
+          addresses.add(off)
+        i = type_bytes.find(key, i + 1)
+    return addresses
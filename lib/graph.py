@@ -0,0 +1,234 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# In-memory dependency graph of all indexed objects,
+# loaded with a few set-based queries.
+
+import sys
+import threading
+import collections
+
+from lib.errors import warn
+from lib import trace
+from lib.model import (Package, Object, Symbol, get_generation)
+from lib.symtab import SymbolTable
+
+# Max number of IDs in a single IN (...) list
+MAX_IN_LIST = 500
+
+class Graph:
+  def __init__(self):
+    self.pkgs = {}
+    self.objects = {}
+    self.sonames = {}
+    self.pkg_objects = {}
+    self.generation = None
+    self.multi_defs = {}
+    self.exporters = {}
+    self.multi_exporters = {}
+    self.load_orders = {}
+    self.unique_load_orders = {}
+    self.load_orders_lock = threading.Lock()
+
+  # Loads all objects and their dependencies
+  # (symbols are loaded on demand via SymbolCache)
+  @classmethod
+  @trace.traced('load graph', 'db')
+  def load(cls, cur):
+    graph = Graph()
+    graph.generation = get_generation(cur)
+
+    for pkg in Package.deserialize_all(cur):
+      graph.pkgs[pkg.id] = pkg
+      graph.pkg_objects[pkg.id] = []
+
+    cur.execute('SELECT Objects.ID, Objects.Name, SoName, IsShlib, IsSymbolic, PackageID FROM Objects INNER JOIN Packages ON Objects.PackageID = Packages.ID WHERE Complete ORDER BY Objects.ID')
+    for ID, name, soname, is_shlib, is_symbolic, pkg_id in cur.fetchall():
+      pkg = graph.pkgs[pkg_id]
+      obj = Object(name, soname, pkg, [], None, None, is_shlib, is_symbolic)
+      obj.id = ID
+      graph.objects[ID] = obj
+      graph.pkg_objects[pkg_id].append(obj)
+      if not soname:
+        continue
+      orig_obj = graph.sonames.get(soname)
+      if orig_obj is None:
+        graph.sonames[soname] = obj
+      else:
+        warn("duplicate implementations of SONAME '%s': %s (from %s) and %s (from %s)"
+             % (soname, obj.name, pkg.name, orig_obj.name, orig_obj.pkg.name))
+
+    # Deps are resolved by soname so cycles are fine
+    cur.execute('SELECT ObjectID, DepName FROM ShlibDeps')
+    for obj_id, dep_name in cur.fetchall():
+      obj = graph.objects.get(obj_id)
+      dep_obj = graph.sonames.get(dep_name)
+      if obj is not None and dep_obj is not None:
+        obj.deps.append(dep_obj)
+
+    graph.load_multi_defs(cur)
+
+    return graph
+
+  # Builds inverted index of exported symbols:
+  # - name ID -> exporting object ID (first one for multiple definitions)
+  # - name ID -> all exporting object IDs (for multiple definitions)
+  # - object ID -> name ID -> symbols which are exported
+  #   by more than one object (only they can be interposed)
+  def load_multi_defs(self, cur):
+    cur.execute('SELECT ObjectID, NameID, Flags FROM Symbols WHERE ImportOrExport = 0')
+    rows = [row for row in cur.fetchall() if row[0] in self.objects]
+
+    multi_ids = set()
+    for obj_id, name_id, _ in rows:
+      if self.exporters.setdefault(name_id, obj_id) != obj_id:
+        multi_ids.add(name_id)
+
+    names = {}
+    multi_list = list(multi_ids)
+    for i in range(0, len(multi_list), MAX_IN_LIST):
+      batch = multi_list[i:i + MAX_IN_LIST]
+      cur.execute('SELECT ID, Name FROM SymbolNames WHERE ID IN (%s)' % ', '.join(['%s'] * len(batch)),
+                  batch)
+      for name_id, name in cur.fetchall():
+        names[name_id] = sys.intern(name)
+
+    multi_exporters = collections.defaultdict(set)
+    for obj_id, name_id, flags in rows:
+      if name_id not in multi_ids:
+        continue
+      multi_exporters[name_id].add(obj_id)
+      obj = self.objects[obj_id]
+      sym = Symbol(names[name_id], obj, bool(flags & Symbol.WEAK), bool(flags & Symbol.PROTECTED))
+      sym.name_id = name_id
+      self.multi_defs.setdefault(obj_id, {})[name_id] = sym
+    self.multi_exporters = {name_id : frozenset(ids) for name_id, ids in multi_exporters.items()}
+
+  # Checks whether any of objects (given as set of IDs) exports name
+  def is_exported(self, name_id, obj_ids):
+    if self.exporters.get(name_id) in obj_ids:
+      return True
+    ids = self.multi_exporters.get(name_id)
+    return ids is not None and not ids.isdisjoint(obj_ids)
+
+  # Executables of package
+  def get_pkg_objects(self, pkg):
+    return [obj for obj in self.pkg_objects.get(pkg.id, []) if not obj.is_shlib]
+
+  # All objects reachable from given ones
+  def get_closure(self, objs):
+    seen = set()
+    pending = list(objs)
+    closure = []
+    while pending:
+      obj = pending.pop()
+      if obj.id in seen:
+        continue
+      seen.add(obj.id)
+      closure.append(obj)
+      pending += obj.deps
+    return closure
+
+  # Returns libraries loaded for given deps (in breadth-first order
+  # like dynamic linker does) and libraries without SONAME.
+  # Many executables share the same DT_NEEDED list so results
+  # are memoized by tuple of dep IDs and identical
+  # load orders are stored only once.
+  def get_load_order(self, deps):
+    key = tuple(obj.id for obj in deps)
+    with self.load_orders_lock:
+      res = self.load_orders.get(key)
+    if res is not None:
+      return res
+
+    lib_list = []
+    no_soname = []
+    loaded_sonames = set()
+    pending_libs = deps
+    while pending_libs:
+      new_pending_libs = []
+      for obj in pending_libs:
+        # TODO: check soname is present for libs
+        if obj.soname is None:
+          no_soname.append(obj)
+        elif obj.soname not in loaded_sonames:
+          lib_list.append(obj)
+          loaded_sonames.add(obj.soname)
+          new_pending_libs += obj.deps
+      pending_libs = new_pending_libs
+    res = tuple(lib_list), tuple(no_soname)
+
+    with self.load_orders_lock:
+      res = self.unique_load_orders.setdefault(res, res)
+      res = self.load_orders.setdefault(key, res)
+    return res
+
+  # Returns dict object ID -> (imports, exports) (as SymbolTables)
+  # (exports are not loaded if imports_only is set)
+  def load_symbols(self, cur, objs, imports_only=False):
+    cond = ' AND ImportOrExport = 1' if imports_only else ''
+    syms = {}
+    for i in range(0, len(objs), MAX_IN_LIST):
+      batch = {obj.id : obj for obj in objs[i:i + MAX_IN_LIST]}
+      for obj_id, obj in batch.items():
+        syms[obj_id] = SymbolTable(obj), SymbolTable(obj)
+      cur.execute('SELECT ObjectID, NameID, Name, Flags, ImportOrExport FROM Symbols INNER JOIN SymbolNames ON Symbols.NameID = SymbolNames.ID WHERE ObjectID IN (%s)%s' % (', '.join(['%s'] * len(batch)), cond),
+                  list(batch.keys()))
+      for obj_id, name_id, name, flags, import_or_export in cur.fetchall():
+        imports, exports = syms[obj_id]
+        (imports if import_or_export else exports).add(name, flags, name_id)
+    for imports, exports in syms.values():
+      imports.freeze()
+      exports.freeze()
+    return syms
+
+# Cache of object imports shared by all workers in process
+# with least recently used objects evicted when memory budget
+# is exceeded. Commonly used libs (libc, libstdc++, etc.)
+# thus stay in memory.
+class SymbolCache:
+  def __init__(self, graph, max_size, arrays=None):
+    self.graph = graph
+    self.arrays = arrays
+    self.max_size = max_size
+    self.lock = threading.Lock()
+    self.entries = collections.OrderedDict()
+    self.size = 0
+
+  # Returns dict object ID -> (imports, array of import IDs or None),
+  # number of hits and misses
+  def get(self, cur, objs):
+    syms = {}
+    missing = []
+    with self.lock:
+      for obj in objs:
+        entry = self.entries.get(obj.id)
+        if entry is None:
+          missing.append(obj)
+        else:
+          self.entries.move_to_end(obj.id)
+          syms[obj.id] = entry
+    nhits = len(syms)
+
+    # Load outside of lock (other worker may load same objects
+    # concurrently but this is harmless)
+    with trace.span('load symbols', 'db', objects=len(missing)):
+      new_syms = self.graph.load_symbols(cur, missing, imports_only=True)
+
+    with self.lock:
+      for obj_id, (imports, _) in new_syms.items():
+        ids = None if self.arrays is None else self.arrays.get_import_ids(imports)
+        syms[obj_id] = entry = imports, ids
+        if obj_id in self.entries:
+          continue
+        self.entries[obj_id] = entry
+        self.size += imports.nbytes()
+      while self.size > self.max_size and self.entries:
+        _, (imports, _) = self.entries.popitem(last=False)
+        self.size -= imports.nbytes()
+
+    return syms, nhits, len(missing)
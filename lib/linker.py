@@ -7,11 +7,14 @@
 
 import re
 
+dynamic_linker_re = re.compile(r'^ld-.*\.so$')
+libc_sublib_re = re.compile(r'^lib(c|m|rt|pthread)-')
+
 def is_dynamic_linker(filename):
-  return re.match(r'^ld-.*\.so$', filename)
+  return dynamic_linker_re.match(filename)
 
 def is_libc(filename):
   return filename.startswith('libc-')
 
 def is_libc_sublib(filename):
-  return re.match(r'^lib(c|m|rt|pthread)-', filename)
+  return libc_sublib_re.match(filename)
@@ -5,16 +5,19 @@
 # Use of this source code is governed by The MIT License (MIT)
 # that can be found in the LICENSE.txt file.
 
+import hashlib
+import uuid
+
 from lib import database
 from lib import errors
-from lib.errors import warn
 
 class Package:
-  __slots__ = ['name', 'source_name', 'lst', 'id', 'has_errors']
+  __slots__ = ['name', 'source_name', 'version', 'lst', 'id', 'has_errors']
 
-  def __init__(self, name, source_name=None):
+  def __init__(self, name, source_name=None, version=None):
     self.name = name
     self.source_name = source_name
+    self.version = version
     self.lst = []
 
     self.id = None
@@ -26,15 +29,22 @@ class Package:
 
   @classmethod
   def create_schema(cls, cur):
-    cur.execute('CREATE TABLE Packages (ID INT UNSIGNED NOT NULL AUTO_INCREMENT, Name VARCHAR(64), SourceName VARCHAR(32), PRIMARY KEY (ID))')
-    cur.execute('CREATE TABLE Errors (PackageID INT UNSIGNED, Message VARCHAR(1024), FOREIGN KEY (PackageID) REFERENCES Packages(ID))')
+    # Complete is set once all objects of package have been stored
+    cur.execute('CREATE TABLE IF NOT EXISTS Packages (ID INT UNSIGNED NOT NULL AUTO_INCREMENT, Name VARCHAR(64), SourceName VARCHAR(32), Version VARCHAR(64), Complete BOOLEAN, PRIMARY KEY (ID))')
+    cur.execute('CREATE TABLE IF NOT EXISTS Errors (PackageID INT UNSIGNED, Message VARCHAR(1024), FOREIGN KEY (PackageID) REFERENCES Packages(ID))')
 
-  def serialize(self, cur, error_msg):
+  # Package rows are written together with rows of its objects
+  # so they are complete as soon as they become visible
+  def serialize_rows(self, rows, error_msg):
     source_name = self.source_name or ''
-    cur.execute('INSERT INTO Packages (Name, SourceName) VALUES (%s, %s)', (self.name, source_name))
-    self.id = int(cur.lastrowid)
+    rows['Packages'].append((self.id, self.name, source_name, self.version, True))
     if error_msg:
-      cur.execute('INSERT INTO Errors (PackageID, Message) VALUES (%s, %s)', (self.id, error_msg))
+      rows['Errors'].append((self.id, error_msg))
+
+  @classmethod
+  def remove(cls, cur, pkg_id):
+    cur.execute('DELETE FROM Errors WHERE PackageID = %s', (pkg_id,))
+    cur.execute('DELETE FROM Packages WHERE ID = %s', (pkg_id,))
 
   @classmethod
   def create_indices(cls, cur):
@@ -43,12 +53,12 @@ class Package:
 
   @classmethod
   def deserialize(cls, cur, name):
-    cur.execute('SELECT * FROM Packages WHERE Name = "%s"' % name)
+    cur.execute('SELECT ID, Name, SourceName, Version FROM Packages WHERE Name = %s AND Complete', (name,))
     pkg = None
-    for ID, name, source_name in cur.fetchall():
+    for ID, name, source_name, version in cur.fetchall():
       if pkg is not None:
         errors.fatal_error("found multiple packages named '%s'" % name)
-      pkg = Package(name, source_name)
+      pkg = Package(name, source_name, version)
       pkg.id = ID
     if pkg is None:
       errors.fatal_error("found no package named '%s'" % name)
@@ -56,18 +66,25 @@ class Package:
 
   @classmethod
   def deserialize_all(cls, cur):
-    cur.execute('SELECT * FROM Packages')
+    cur.execute('SELECT Packages.ID, Name, SourceName, Version, COUNT(Errors.PackageID) FROM Packages LEFT JOIN Errors ON Packages.ID = Errors.PackageID WHERE Complete GROUP BY Packages.ID, Name, SourceName, Version')
     pkgs = []
-    for ID, name, source_name in cur.fetchall():
-      pkg = Package(name, source_name)
+    for ID, name, source_name, version, nerrors in cur.fetchall():
+      pkg = Package(name, source_name, version)
       pkg.id = ID
-      cur.execute('SELECT COUNT(*) FROM Errors WHERE PackageID = %d' % ID)
-      row = cur.fetchone() 
-      if row[0] != 0:
-        pkg.has_errors = True
+      pkg.has_errors = nerrors != 0
       pkgs.append(pkg)
     return pkgs
 
+  # Returns stored packages (including incomplete ones) as
+  # dict name -> (ID, version, complete, has_errors)
+  @classmethod
+  def deserialize_states(cls, cur):
+    cur.execute('SELECT Packages.ID, Name, Version, Complete, COUNT(Errors.PackageID) FROM Packages LEFT JOIN Errors ON Packages.ID = Errors.PackageID GROUP BY Packages.ID, Name, Version, Complete')
+    states = {}
+    for ID, name, version, complete, nerrors in cur.fetchall():
+      states.setdefault(name, []).append((ID, version, bool(complete), nerrors != 0))
+    return states
+
 class Object:
   __slots__ = ['name', 'soname', 'pkg', 'deps', 'imports', 'exports', 'is_shlib', 'is_symbolic', 'id']
 
@@ -83,9 +100,16 @@ class Object:
 
     self.id = None
 
-    # A workaround for not modelling sym versions.
-    self.filter_dups(self.imports)
-    self.filter_dups(self.exports)
+    # Symbols are stored in SymbolTables
+    # (analysis loads them separately so they may be missing)
+    for syms in (imports, exports):
+      if syms is not None:
+        syms.obj = self
+
+  # Returns same object under different name (e.g. for hardlinks)
+  def copy(self, name):
+    return Object(name, self.soname, self.pkg, self.deps, self.imports.copy(),
+                  self.exports.copy(), self.is_shlib, self.is_symbolic)
 
   def __repr__(self):
     return """\
@@ -97,28 +121,23 @@ class Object:
 """ % ('Shlib' if self.is_shlib else 'Executable', self.name, self.soname, self.deps,
        self.imports, self.exports, self.is_symbolic)
 
-  # Suppress warnings for e.g. _sys_nerr@@GLIBC_2.12 and _sys_nerr@GLIBC_2.4
-  def filter_dups(self, sym_list):
-    lst = []
-    lst_names = {sym.name for sym in sym_list}
-    for sym in sym_list:
-      if sym.name not in lst_names:
-        lst.append(sym)
-    sym_list[:] = lst
-
   @classmethod
   def create_schema(cls, cur):
-    cur.execute('CREATE TABLE Objects (ID INT UNSIGNED NOT NULL AUTO_INCREMENT, Name VARCHAR(128), SoName VARCHAR(128), IsShlib BOOLEAN, IsSymbolic BOOLEAN, PackageID INT UNSIGNED, PRIMARY KEY (ID), FOREIGN KEY (PackageID) REFERENCES Packages(ID))')
-    cur.execute('CREATE TABLE ShlibDeps (ObjectID INT UNSIGNED, DepName VARCHAR(64), FOREIGN KEY (ObjectID) REFERENCES Objects(ID))')
+    cur.execute('CREATE TABLE IF NOT EXISTS Objects (ID INT UNSIGNED NOT NULL AUTO_INCREMENT, Name VARCHAR(128), SoName VARCHAR(128), IsShlib BOOLEAN, IsSymbolic BOOLEAN, PackageID INT UNSIGNED, PRIMARY KEY (ID), FOREIGN KEY (PackageID) REFERENCES Packages(ID))')
+    cur.execute('CREATE TABLE IF NOT EXISTS ShlibDeps (ObjectID INT UNSIGNED, DepName VARCHAR(64), FOREIGN KEY (ObjectID) REFERENCES Objects(ID))')
 
-  def serialize(self, cur, pkg_id):
+  def serialize_rows(self, rows, pkg_id, names):
     soname = self.soname or ''
-    cur.execute('INSERT INTO Objects (Name, SoName, IsShlib, IsSymbolic, PackageID) VALUES (%s, %s, %s, %s, %s)', (self.name, soname, self.is_shlib, self.is_symbolic, pkg_id))
-    self.id = int(cur.lastrowid)
-    cur.executemany('INSERT INTO ShlibDeps (ObjectID, DepName) VALUES (%s, %s)', [(self.id, dep) for dep in self.deps])
-    cur.executemany('INSERT INTO Symbols (Name, Version, IsWeak, IsProtected, ImportOrExport, ObjectID) VALUES (%s, %s, %s, %s, %s, %s)',
-                    [(sym.name, sym.version, sym.is_weak, sym.is_protected, i < len(self.imports), self.id)
-                     for i, sym in enumerate(self.imports + self.exports)])
+    rows['Objects'].append((self.id, self.name, soname, self.is_shlib, self.is_symbolic, pkg_id))
+    rows['ShlibDeps'] += [(self.id, dep) for dep in self.deps]
+    for import_or_export, syms in ((True, self.imports), (False, self.exports)):
+      rows['Symbols'] += [(self.id, names.intern(name, rows), import_or_export, flags)
+                          for name, flags in syms.rows()]
+
+  @classmethod
+  def remove_pkg_objects(cls, cur, pkg_id):
+    cur.execute('DELETE FROM ShlibDeps WHERE ObjectID IN (SELECT ID FROM Objects WHERE PackageID = %s)', (pkg_id,))
+    cur.execute('DELETE FROM Objects WHERE PackageID = %s', (pkg_id,))
 
   @classmethod
   def create_indices(cls, cur):
@@ -127,38 +146,44 @@ class Object:
     database.maybe_create_key(cur, 'Objects', ['PackageID'])
     database.maybe_create_key(cur, 'ShlibDeps', ['ObjectID'])
 
-  @classmethod
-  def deserialize_pkg_objects(cls, cur, pkg):
-    cur.execute('SELECT * FROM Objects WHERE PackageID = %d AND IsShlib = FALSE' % pkg.id)
-    objects = []
-    for ID, name, soname, is_shlib, is_symbolic, _ in cur.fetchall():
-      obj = Object(name, soname, pkg, [], [], [], is_shlib, is_symbolic)
-      obj.id = ID
-      objects.append(obj)
-    return objects
-
-  def deserialize_deps(self, cur):
-    if not hasattr(Object.deserialize_deps, 'warned_sonames'):
-      Object.deserialize_deps.warned_sonames = set()
-    self.deps = []
-    cur.execute('SELECT Objects.ID, Objects.Name, SoName, IsShlib, IsSymbolic, Packages.ID, Packages.Name, Packages.SourceName FROM (Objects INNER JOIN ShlibDeps ON Objects.SoName = ShlibDeps.DepName INNER JOIN Packages ON Objects.PackageID = Packages.ID) WHERE ShlibDeps.ObjectID = %d' % self.id)
-    soname_origins = {}
-    for ID, obj_name, soname, is_shlib, is_symbolic, pkg_id, pkg_name, pkg_source_name in cur.fetchall():
-      if soname in soname_origins and soname not in Object.deserialize_deps.warned_sonames:
-        orig_obj_name, orig_pkg_name = soname_origins[soname]
-        warn("duplicate implementations of SONAME '%s': %s (from %s) and %s (from %s)" % (soname, obj_name, pkg_name, orig_obj_name, orig_pkg_name))
-        Object.deserialize_deps.warned_sonames.add(soname)
-        continue
-      soname_origins[soname] = obj_name, pkg_name
-      pkg = Package(pkg_name, pkg_source_name)
-      pkg.id = pkg_id
-      obj = Object(obj_name, soname, pkg, [], [], [], is_shlib, is_symbolic)
-      obj.id = ID
-      obj.deserialize_deps(cur)  # TODO: circular deps
-      self.deps.append(obj)
+# Symbol names are stored once in SymbolNames table.
+# Their IDs are hashes of names so that any worker can compute them
+# without talking to DB.
+def get_name_id(name):
+  h = hashlib.blake2b(name.encode('utf-8', errors='surrogateescape'), digest_size=8).digest()
+  return int.from_bytes(h, 'little') >> 1  # Fit to signed BIGINT
+
+# Remembers names which have already been emitted by this worker
+class NameTable:
+  __slots__ = ['ids', 'max_size']
+
+  def __init__(self, max_size=1000000):
+    self.ids = {}
+    self.max_size = max_size
+
+  # Returns ID of name and adds new names to SymbolNames rows
+  def intern(self, name, rows):
+    name_id = self.ids.get(name)
+    if name_id is None:
+      if len(self.ids) >= self.max_size:
+        # Forgetting names only causes duplicate (ignored) inserts
+        self.ids.clear()
+      name_id = get_name_id(name)
+      self.ids[name] = name_id
+      rows['SymbolNames'].append((name_id, name))
+    return name_id
+
+  # Forgets names whose SymbolNames rows were not committed
+  # (so that they are emitted again)
+  def forget(self, name_rows):
+    for _, name in name_rows:
+      self.ids.pop(name, None)
 
 class Symbol:
-  __slots__ = ['name', 'obj', 'is_weak', 'is_protected', 'version', 'id']
+  __slots__ = ['name', 'obj', 'is_weak', 'is_protected', 'version', 'name_id']
+
+  WEAK = 1
+  PROTECTED = 2
 
   def __init__(self, name, obj, is_weak, is_protected):
     self.name = name
@@ -167,7 +192,7 @@ class Symbol:
     self.is_protected = is_protected
     self.version = 0  #TODO
 
-    self.id = None
+    self.name_id = None
 
   def __repr__(self):
     s = ["Symbol %s%s (in object %s)" % (self.name, ('@' + self.version) if self.version else '', self.obj.name)]
@@ -177,33 +202,68 @@ class Symbol:
       s.append('protected')
     return ' '.join(s)
 
+  def flags(self):
+    return Symbol.make_flags(self.is_weak, self.is_protected)
+
+  @staticmethod
+  def make_flags(is_weak, is_protected):
+    return (Symbol.WEAK if is_weak else 0) | (Symbol.PROTECTED if is_protected else 0)
+
   @classmethod
   def create_schema(cls, cur):
-    cur.execute('CREATE TABLE Symbols (ID INT UNSIGNED NOT NULL AUTO_INCREMENT, Name VARCHAR(1024), Version VARCHAR(32), IsWeak BOOLEAN, IsProtected BOOLEAN, ImportOrExport BOOLEAN, ObjectID INT UNSIGNED, PRIMARY KEY (ID), FOREIGN KEY (ObjectID) REFERENCES Objects(ID))')
+    cur.execute('CREATE TABLE IF NOT EXISTS SymbolNames (ID BIGINT NOT NULL, Name VARCHAR(1024), PRIMARY KEY (ID))')
+    # Flags are a combination of WEAK and PROTECTED
+    cur.execute('CREATE TABLE IF NOT EXISTS Symbols (ObjectID INT UNSIGNED, NameID BIGINT, ImportOrExport BOOLEAN, Flags TINYINT UNSIGNED, FOREIGN KEY (ObjectID) REFERENCES Objects(ID), FOREIGN KEY (NameID) REFERENCES SymbolNames(ID))')
 
   @classmethod
   def create_indices(cls, cur):
-    database.maybe_create_key(cur, 'Symbols', ['ObjectID'])
+    database.maybe_create_key(cur, 'Symbols', ['ObjectID', 'ImportOrExport'])
+    database.maybe_create_key(cur, 'Symbols', ['NameID'])
 
   @classmethod
-  def deserialize_syms(cls, cur, obj):
-    cur.execute('SELECT ID, Name, IsWeak, IsProtected, ImportOrExport FROM Symbols WHERE ObjectID = %d' % obj.id)
-    imports = []
-    exports = []
-    for ID, name, is_weak, is_protected, import_or_export in cur.fetchall():
-      sym = Symbol(name, obj, is_weak, is_protected)
-      sym.id = ID
-      if import_or_export:
-        imports.append(sym)
-      else:
-        exports.append(sym)
-    return imports, exports
-
-def create_schema(db_name=None):
-  database.create_db(db_name)
-  conn = database.connect(db_name)
+  def remove_pkg_syms(cls, cur, pkg_id):
+    cur.execute('DELETE FROM Symbols WHERE ObjectID IN (SELECT ID FROM Objects WHERE PackageID = %s)', (pkg_id,))
+
+# Columns filled by serialize_rows methods (in insertion order)
+serialized_columns = [
+  ('Packages', ('ID', 'Name', 'SourceName', 'Version', 'Complete')),
+  ('Errors', ('PackageID', 'Message')),
+  ('Objects', ('ID', 'Name', 'SoName', 'IsShlib', 'IsSymbolic', 'PackageID')),
+  ('ShlibDeps', ('ObjectID', 'DepName')),
+  ('SymbolNames', ('ID', 'Name')),
+  ('Symbols', ('ObjectID', 'NameID', 'ImportOrExport', 'Flags')),
+]
+
+# Tables where rows may already be present
+shared_tables = {'SymbolNames'}
+
+# Remove all data of previously stored package
+def remove_package(cur, pkg_id):
+  Symbol.remove_pkg_syms(cur, pkg_id)
+  Object.remove_pkg_objects(cur, pkg_id)
+  Package.remove(cur, pkg_id)
+
+# Generation identifies contents of database
+# and changes whenever it is modified
+# (derived data like conflict tables is cached per generation).
+def bump_generation(cur):
+  cur.execute("REPLACE INTO Meta (Name, Value) VALUES ('Generation', %s)", (uuid.uuid4().hex,))
+
+def get_generation(cur):
+  cur.execute("SELECT Value FROM Meta WHERE Name = 'Generation'")
+  row = cur.fetchone()
+  return row[0] if row is not None else None
+
+# Unless incremental, existing database is dropped
+def create_schema(db, incremental=False):
+  db.create(drop=not incremental)
+  conn = db.connect()
   with conn as cur:
     Package.create_schema(cur)
     Object.create_schema(cur)
     Symbol.create_schema(cur)
+    database.create_sequence(cur, 'Packages')
+    database.create_sequence(cur, 'Objects')
+    cur.execute('CREATE TABLE IF NOT EXISTS Meta (Name VARCHAR(32) NOT NULL, Value VARCHAR(64), PRIMARY KEY (Name))')
+    bump_generation(cur)
   conn.close()
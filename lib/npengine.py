@@ -0,0 +1,92 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Vectorized implementation of duplicate and unresolved symbol checks.
+# Exported names are mapped to dense int32 IDs and per-object symbol
+# sets are kept as int32 arrays.
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+class Arrays:
+  def __init__(self, graph, cur):
+    self.graph = graph
+
+    # Only exported names matter for resolution, imported names
+    # which nobody exports get -1
+    self.dense_ids = {name_id : i for i, name_id in enumerate(graph.exporters)}
+    self.name_ids = np.array(list(graph.exporters), dtype=np.int64)
+
+    # Exports of each object as sorted array of dense IDs
+    cur.execute('SELECT ObjectID, NameID FROM Symbols WHERE ImportOrExport = 0')
+    rows = [(obj_id, self.dense_ids[name_id]) for obj_id, name_id in cur.fetchall()
+            if obj_id in graph.objects]
+    self.exports = {}
+    if rows:
+      obj_ids, ids = np.array(rows, dtype=np.int64).T
+      order = np.lexsort((ids, obj_ids))
+      obj_ids = obj_ids[order]
+      ids = ids[order].astype(np.int32)
+      starts = np.flatnonzero(np.r_[True, obj_ids[1:] != obj_ids[:-1]])
+      for obj_id, group in zip(obj_ids[starts], np.split(ids, starts[1:])):
+        self.exports[int(obj_id)] = group
+
+    # Multiply defined symbols of each object
+    # (in order of Graph.multi_defs)
+    self.multi_defs = {obj_id : np.array([self.dense_ids[name_id] for name_id in syms], dtype=np.int32)
+                       for obj_id, syms in graph.multi_defs.items()}
+
+    self.empty = np.zeros(0, dtype=np.int32)
+
+  def get_import_ids(self, imports):
+    dense_ids = self.dense_ids
+    return np.array([dense_ids.get(name_id, -1) for name_id in imports.name_ids], dtype=np.int32)
+
+  # Returns first definitions of symbols (dict name ID -> object)
+  # and ordered pairs of objects which provide first and later
+  # definition of some symbol (same as Python implementation).
+  def find_dup_pairs(self, lib_list):
+    arrays = [self.multi_defs.get(obj.id, self.empty) for obj in lib_list]
+    ids = np.concatenate(arrays)
+    if not len(ids):
+      return {}, []
+    pos = np.repeat(np.arange(len(lib_list)), [len(a) for a in arrays])
+
+    # Index of first occurrence of each name
+    uniq, first = np.unique(ids, return_index=True)
+    origin_pos = pos[first[np.searchsorted(uniq, ids)]]
+    dups = origin_pos != pos
+
+    sym_origins = dict(zip(self.name_ids[uniq].tolist(),
+                           (lib_list[p] for p in pos[first].tolist())))
+
+    # Pairs in order of first occurrence
+    codes = origin_pos[dups] * len(lib_list) + pos[dups]
+    codes, idx = np.unique(codes, return_index=True)
+    codes = codes[np.argsort(idx)]
+    pairs = [(lib_list[code // len(lib_list)], lib_list[code % len(lib_list)]) for code in codes.tolist()]
+
+    return sym_origins, pairs
+
+  # Returns list of (object, symbol) for imports which are not
+  # exported by any of loaded objects
+  def find_unresolved(self, lib_list, imports):
+    exports = np.concatenate([self.exports.get(obj.id, self.empty) for obj in lib_list])
+    ids = np.concatenate([imports[obj.id][1] for obj in lib_list])
+    unres = np.flatnonzero(~np.isin(ids, exports))
+    if not len(unres):
+      return []
+    # Map positions back to objects
+    ends = np.cumsum([len(imports[obj.id][0]) for obj in lib_list])
+    res = []
+    for i in unres.tolist():
+      k = int(np.searchsorted(ends, i, side='right'))
+      start = int(ends[k - 1]) if k else 0
+      res.append((lib_list[k], imports[lib_list[k].id][0][i - start]))
+    return res
@@ -0,0 +1,96 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# On-disk cache of parsed ELF objects keyed by contents hash.
+# Safe to share between threads and processes (entries are written
+# atomically and eviction tolerates concurrent removals).
+
+import os
+import os.path
+import hashlib
+import pickle
+import tempfile
+import threading
+
+from lib.model import Object
+
+class ObjectCache:
+  def __init__(self, path, max_size, version):
+    self.path = path
+    self.max_size = max_size
+    self.version = version
+    self.lock = threading.Lock()
+    os.makedirs(path, exist_ok=True)
+    self.size = sum(size for _, _, size in self.scan())
+
+  def key(self, data):
+    h = hashlib.sha256(data)
+    h.update(b'\0%d' % self.version)
+    return h.hexdigest()
+
+  def entry_path(self, key):
+    return os.path.join(self.path, key[:2], key)
+
+  def scan(self):
+    entries = []
+    for root, _, files in os.walk(self.path):
+      for basename in files:
+        if basename.startswith('.tmp'):
+          continue
+        f = os.path.join(root, basename)
+        try:
+          st = os.stat(f)
+        except FileNotFoundError:
+          continue
+        entries.append((st.st_mtime, f, st.st_size))
+    return entries
+
+  # Returns cached Object or None
+  def lookup(self, key, f, pkg):
+    path = self.entry_path(key)
+    try:
+      with open(path, 'rb') as stream:
+        soname, deps, is_shlib, is_symbolic, imports, exports = pickle.load(stream)
+      # Mark as recently used
+      os.utime(path)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+      return None
+    return Object(os.path.basename(f), soname, pkg, deps, imports, exports, is_shlib, is_symbolic)
+
+  # Stores object and returns number of evicted entries
+  def store(self, key, obj):
+    # Symbol tables are pickled in compact form
+    record = (obj.soname, obj.deps, obj.is_shlib, obj.is_symbolic, obj.imports, obj.exports)
+    path = self.entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+    with os.fdopen(fd, 'wb') as stream:
+      pickle.dump(record, stream, pickle.HIGHEST_PROTOCOL)
+      size = stream.tell()
+    os.replace(tmp, path)
+
+    with self.lock:
+      self.size += size
+      if self.size <= self.max_size:
+        return 0
+      return self.evict()
+
+  # Remove least recently used entries until we are 10% below limit
+  def evict(self):
+    entries = sorted(self.scan())
+    self.size = sum(size for _, _, size in entries)
+    nevicted = 0
+    for _, f, size in entries:
+      if self.size <= 0.9 * self.max_size:
+        break
+      try:
+        os.unlink(f)
+        nevicted += 1
+      except FileNotFoundError:
+        pass
+      self.size -= size
+    return nevicted
@@ -5,62 +5,177 @@
 # Use of this source code is governed by The MIT License (MIT)
 # that can be found in the LICENSE.txt file.
 
+import os
 import threading
 import queue
 import multiprocessing
+import concurrent.futures
 
 from lib.errors import warn
+from lib import trace
+from lib.schedule import order_by_cost
+
+executors = ['thread', 'process']
+
+# Tells worker thread that there are no more tasks
+END = object()
+
+def default_num_workers():
+  ncpu = multiprocessing.cpu_count()
+  return int((1.5 * ncpu) if ncpu > 1 else 2)
 
 class WorkerThread(threading.Thread):
-  __slots__ = ['q', 'exceptions', 'action', 'ctx', 'results']
+  __slots__ = ['q', 'exceptions', 'action', 'init', 'fini', 'collect', 'ctx', 'results']
 
-  def __init__(self, q, action):
+  def __init__(self, q, action, init=None, fini=None, collect=None):
     threading.Thread.__init__(self)
     self.q = q
     self.exceptions = []
     self.action = action
-    self.ctx = [None]
+    self.init = init
+    self.fini = fini
+    self.collect = collect
+    self.ctx = None
     self.results = []
 
   def run(self):
     try:
-      while not self.q.empty():
-        item = None
-        try:
-          item = self.q.get(False)
-          result = self.action(item, self.ctx)
+      if self.init is not None:
+        self.ctx = self.init()
+      while True:
+        item = self.q.get()
+        if item is END:
+          break
+        result = self.action(item, self.ctx)
+        if result is not None:
           self.results.append(result)
-        except queue.Empty:
-          pass
-        finally:
-          if item:
-            self.q.task_done()
+    except Exception as e:
+      self.exceptions.append(e)
+    try:
+      if self.fini is not None:
+        value = self.fini(self.ctx)
+        if self.collect is not None and value is not None:
+          self.collect(value)
     except Exception as e:
       self.exceptions.append(e)
 
-def serial_map(fun, tasks, num_threads):
+def serial_map(fun, tasks, num_threads, init=None, fini=None):
   results = []
-  ctx = []
+  exceptions = []
   try:
+    ctx = init() if init is not None else None
     for task in tasks:
       result = fun(task, ctx)
       results.append(result)
+    if fini is not None:
+      fini(ctx)
   except Exception as e:
-    exceptions = [e]
-  return results, exceptions
+    exceptions.append(e)
+  return [results], [exceptions]
+
+# Per-process worker state for process pools.
+# Pools are forked so fun and init need not be picklable
+# (only tasks, results and exceptions are).
+worker_fun = None
+worker_init = None
+worker_fini = None
+worker_ctx = None
+
+def init_process(fun, init, fini):
+  global worker_fun, worker_init, worker_fini
+  worker_fun = fun
+  worker_init = init
+  worker_fini = fini
+
+# Returns pid, results, exceptions and value returned by fini
+def run_chunk(chunk):
+  global worker_init, worker_ctx
+  results = []
+  exceptions = []
+  value = None
+  try:
+    if worker_init is not None:
+      init = worker_init
+      worker_init = None
+      worker_ctx = init()
+    for task in chunk:
+      try:
+        result = worker_fun(task, worker_ctx)
+        if result is not None:
+          results.append(result)
+      except Exception as e:
+        exceptions.append(e)
+    if worker_fini is not None:
+      value = worker_fini(worker_ctx)
+    trace.flush()
+  except Exception as e:
+    exceptions.append(e)
+  return os.getpid(), results, exceptions, value
+
+def process_map(fun, tasks, num_procs, init=None, fini=None, chunk_size=None, interleave=False, collect=None):
+  tasks = list(tasks)
+  if not tasks:
+    return [[]], [[]]
+
+  # Several chunks per worker to amortize IPC but still balance load
+  if chunk_size is None:
+    chunk_size = max(1, len(tasks) // (4 * num_procs))
+  if interleave:
+    # Tasks are sorted by cost so deal them round-robin
+    # to avoid putting all expensive ones to first chunk
+    nchunks = (len(tasks) + chunk_size - 1) // chunk_size
+    chunks = [tasks[i::nchunks] for i in range(nchunks)]
+  else:
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
 
-def map(fun, tasks, num_threads):
+  results = {}
+  exceptions = {}
+  mp_context = multiprocessing.get_context('fork')
+  with concurrent.futures.ProcessPoolExecutor(num_procs, mp_context=mp_context,
+                                              initializer=init_process,
+                                              initargs=(fun, init, fini)) as pool:
+    # Collect chunks as soon as they are done
+    futures = [pool.submit(run_chunk, chunk) for chunk in chunks]
+    for future in concurrent.futures.as_completed(futures):
+      pid, res, exc, value = future.result()
+      results.setdefault(pid, []).extend(res)
+      exceptions.setdefault(pid, []).extend(exc)
+      if collect is not None and value is not None:
+        collect(value)
+
+  pids = list(results.keys())
+  return [results[pid] for pid in pids], [exceptions[pid] for pid in pids]
+
+# Calls fun(task, ctx) for all tasks where ctx is a per-worker value
+# returned by init() (e.g. a database connection).
+# fini(ctx) is called when worker runs out of tasks (for process pools
+# workers do not know this so it's called after every chunk instead).
+# Non-None values returned by fini are passed to collect(value)
+# in calling process as soon as they are available (so it may be called
+# from worker threads).
+# If cost(task) is given, most expensive tasks are started first.
+# Returns per-worker lists of results (except None) and exceptions.
+def map(fun, tasks, num_threads, init=None, fini=None, executor='thread', chunk_size=None, cost=None, collect=None):
   if num_threads is None:
-    ncpu = multiprocessing.cpu_count()
-    num_threads = int((1.5 * ncpu) if ncpu > 1 else 2)
+    num_threads = default_num_workers()
+
+  if cost is not None:
+    tasks = order_by_cost(list(tasks), cost)
+
+  if executor == 'process':
+    return process_map(fun, tasks, num_threads, init, fini, chunk_size, cost is not None, collect)
+  elif executor != 'thread':
+    raise ValueError("unknown executor '%s'" % executor)
 
   q = queue.Queue(maxsize=0)
   for task in tasks:
     q.put(task)
+  for i in range(num_threads):
+    q.put(END)
 
   workers = []
   for i in range(num_threads):
-    w = WorkerThread(q, fun)
+    w = WorkerThread(q, fun, init, fini, collect)
     workers.append(w)
     w.start()
 
@@ -76,7 +191,7 @@ def raise_errors(exc_lists):
   E = None
   for i, lst in enumerate(exc_lists):
     for e in lst:
-      warn("exception in thread %d: %s" % (i, e))
+      warn("exception in worker %d: %s" % (i, e))
       E = e
   if E is not None:
     raise E
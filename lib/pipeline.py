@@ -0,0 +1,203 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Pipeline of stages connected by bounded queues. Each stage has its own
+# pool of worker threads; when downstream stage falls behind, its input
+# queue fills up and upstream workers block (so number of items in flight
+# and thus memory consumption is bounded).
+#
+# Stage may also run its function in a pool of forked processes
+# (worker threads then just pass items to processes).
+
+import threading
+import queue
+import time
+import multiprocessing
+
+from lib import parallel_map
+from lib import trace
+from lib.analysis import Histogram
+
+# Marks end of input (one per worker of receiving stage)
+END = None
+
+class StageStats:
+  __slots__ = ['items', 'busy_time', 'starved_time', 'blocked_time', 'depth']
+
+  def __init__(self):
+    self.items = 0
+    # Time spent processing items
+    self.busy_time = 0
+    # Time spent waiting for input
+    self.starved_time = 0
+    # Time spent waiting for space in output queue
+    self.blocked_time = 0
+    # Depth of input queue (sampled when items are taken)
+    self.depth = Histogram()
+
+  def merge(self, other):
+    self.items += other.items
+    self.busy_time += other.busy_time
+    self.starved_time += other.starved_time
+    self.blocked_time += other.blocked_time
+    self.depth.merge(other.depth)
+
+  def __str__(self):
+    return "%d items, busy %g sec., starved %g sec., blocked %g sec., input queue depth mean %g, max %d" \
+      % (self.items, self.busy_time, self.starved_time, self.blocked_time,
+         self.depth.mean(), self.depth.max or 0)
+
+# Calls fun(item, ctx) for items from input queue and sends non-None
+# results to next stage. ctx is a per-worker value returned by init()
+# and fini(ctx) is called once input is exhausted (as in parallel_map.map).
+class Stage:
+  def __init__(self, name, fun, num_workers=1, init=None, fini=None, executor='thread'):
+    if executor not in parallel_map.executors:
+      raise ValueError("unknown executor '%s'" % executor)
+    self.name = name
+    self.fun = fun
+    self.num_workers = num_workers
+    self.init = init
+    self.fini = fini
+    self.executor = executor
+    self.pool = None
+    self.stats = StageStats()
+
+  def start_pool(self):
+    # Pool forks all processes right away (before any threads are started)
+    mp_context = multiprocessing.get_context('fork')
+    self.pool = mp_context.Pool(self.num_workers, initializer=parallel_map.init_process,
+                                initargs=(self.fun, self.init, self.fini))
+
+  def stop_pool(self):
+    self.pool.close()
+    self.pool.join()
+    self.pool = None
+
+  def call(self, item, ctx):
+    if self.pool is None:
+      return self.fun(item, ctx)
+    _, results, exceptions, _ = self.pool.apply(parallel_map.run_chunk, ([item],))
+    if exceptions:
+      raise exceptions[0]
+    return results[0] if results else None
+
+class StageWorker(threading.Thread):
+  def __init__(self, pipeline, stage, idx, inq, outq):
+    threading.Thread.__init__(self, name='%s-%d' % (stage.name, idx))
+    self.pipeline = pipeline
+    self.stage = stage
+    self.inq = inq
+    self.outq = outq
+    self.stats = StageStats()
+    self.results = []
+    self.exceptions = []
+
+  def run(self):
+    stage = self.stage
+    stats = self.stats
+    ctx = None
+    ok = True
+    if stage.init is not None and stage.pool is None:
+      try:
+        ctx = stage.init()
+      except Exception as e:
+        self.exceptions.append(e)
+        ok = False
+
+    while True:
+      t0 = time.perf_counter()
+      item = self.inq.get()
+      t1 = time.perf_counter()
+      stats.starved_time += t1 - t0
+      if item is END:
+        break
+      stats.depth.add(self.inq.qsize())
+      # Keep draining input even if worker is broken
+      # so that upstream stages do not hang
+      if not ok:
+        continue
+      try:
+        with trace.span(stage.name, 'pipeline'):
+          result = stage.call(item, ctx)
+      except Exception as e:
+        self.exceptions.append(e)
+        continue
+      finally:
+        t2 = time.perf_counter()
+        stats.busy_time += t2 - t1
+        stats.items += 1
+      if result is None:
+        continue
+      if self.outq is None:
+        self.results.append(result)
+      else:
+        self.outq.put(result)
+        stats.blocked_time += time.perf_counter() - t2
+
+    if ok and stage.fini is not None and stage.pool is None:
+      try:
+        stage.fini(ctx)
+      except Exception as e:
+        self.exceptions.append(e)
+
+    self.pipeline.worker_done(stage)
+
+class Pipeline:
+  def __init__(self, stages, queue_size=16):
+    self.stages = stages
+    self.queue_size = queue_size
+    self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    self.lock = threading.Lock()
+    self.running = {}
+
+  def worker_done(self, stage):
+    with self.lock:
+      self.running[stage] -= 1
+      if self.running[stage]:
+        return
+    # Last worker of stage is done so next stage will not get more input
+    i = self.stages.index(stage)
+    if i + 1 < len(self.stages):
+      next_stage = self.stages[i + 1]
+      for _ in range(next_stage.num_workers):
+        self.queues[i + 1].put(END)
+
+  # Feeds tasks to first stage and returns per-worker lists
+  # of results of last stage and exceptions of all stages
+  def run(self, tasks):
+    for stage in self.stages:
+      if stage.executor == 'process':
+        stage.start_pool()
+
+    workers = []
+    for stage, inq, outq in zip(self.stages, self.queues, self.queues[1:] + [None]):
+      self.running[stage] = stage.num_workers
+      for i in range(stage.num_workers):
+        workers.append(StageWorker(self, stage, i, inq, outq))
+    for w in workers:
+      w.start()
+
+    for task in tasks:
+      self.queues[0].put(task)
+    for _ in range(self.stages[0].num_workers):
+      self.queues[0].put(END)
+
+    for w in workers:
+      w.join()
+
+    for stage in self.stages:
+      if stage.pool is not None:
+        stage.stop_pool()
+
+    for w in workers:
+      w.stage.stats.merge(w.stats)
+
+    last = self.stages[-1]
+    results = [w.results for w in workers if w.stage is last]
+    exceptions = [w.exceptions for w in workers]
+    return results, exceptions
@@ -0,0 +1,163 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Rules for suppressing known false positives, loaded from JSON file
+# (see ignore_rules.json). Patterns are matched at the start of names.
+#
+# Checks are cheap: symbol patterns of all rules are combined
+# into a single regex which rejects most symbols in one match
+# and conditions on objects are evaluated once per object
+# (or pair of objects) and stored as bitmasks.
+
+import re
+import json
+import hashlib
+import threading
+
+from lib import linker
+from lib.errors import Error
+
+# Predicates which can be used in "libraries" conditions
+object_classes = {
+  'dynamic-linker' : linker.is_dynamic_linker,
+  'libc' : linker.is_libc,
+  'libc-sublib' : linker.is_libc_sublib,
+}
+
+def is_related_package(obj, other_obj):
+  # Note that empty source name is a prefix of all names
+  name = obj.pkg.source_name
+  other_name = other_obj.pkg.source_name
+  return name.startswith(other_name) or other_name.startswith(name)
+
+class Rule:
+  __slots__ = ['name', 'symbol', 'library', 'library_package', 'related_packages', 'libraries']
+
+  keys = {'name', 'comment', 'symbol', 'library', 'library_package', 'related_packages', 'libraries'}
+
+  def __init__(self, data, path):
+    if not isinstance(data, dict) or 'name' not in data:
+      raise Error("%s: rule must be an object with a name" % path)
+    self.name = data['name']
+    unknown = set(data.keys()) - self.keys
+    if unknown:
+      raise Error("%s: unknown keys in rule '%s': %s" % (path, self.name, ', '.join(sorted(unknown))))
+    try:
+      compile = lambda key: re.compile(data[key]) if key in data else None
+      self.symbol = compile('symbol')
+      self.library = compile('library')
+      self.library_package = compile('library_package')
+    except re.error as e:
+      raise Error("%s: bad pattern in rule '%s': %s" % (path, self.name, e))
+    self.related_packages = bool(data.get('related_packages', False))
+    self.libraries = data.get('libraries')
+    if self.libraries is not None:
+      if len(self.libraries) != 2 or any(cls not in object_classes for cls in self.libraries):
+        raise Error("%s: 'libraries' in rule '%s' must be a pair of %s" % (path, self.name, ', '.join(sorted(object_classes))))
+
+  # Checks conditions on single object
+  # (for duplicates it's the one which comes later)
+  def matches_object(self, obj):
+    return (self.library is None or self.library.match(obj.name) is not None) \
+      and (self.library_package is None or self.library_package.match(obj.pkg.name) is not None)
+
+  # Checks conditions on pair of objects (in any order)
+  def matches_pair(self, obj, other_obj, classes, other_classes):
+    if self.related_packages and not is_related_package(obj, other_obj):
+      return False
+    if self.libraries is not None:
+      a, b = self.libraries
+      if not ((a in classes and b in other_classes) or (b in classes and a in other_classes)):
+        return False
+    return self.matches_object(obj)
+
+class RuleList:
+  def __init__(self, kind, rules):
+    self.kind = kind
+    self.rules = rules
+    # Rules which do not look at symbol name
+    self.any_symbol_mask = 0
+    for i, rule in enumerate(rules):
+      if rule.symbol is None:
+        self.any_symbol_mask |= 1 << i
+    patterns = ['(?:%s)' % rule.symbol.pattern for rule in rules if rule.symbol is not None]
+    self.prefilter = re.compile('|'.join(patterns)) if patterns else None
+    self.hits = [0] * len(rules)
+    self.lock = threading.Lock()
+
+  # Returns index of first rule (out of those allowed by mask)
+  # which matches symbol or None
+  def find(self, sym, mask):
+    if self.prefilter is None or self.prefilter.match(sym.name) is None:
+      mask &= self.any_symbol_mask
+      if not mask:
+        return None
+    for i, rule in enumerate(self.rules):
+      if (mask >> i) & 1 and (rule.symbol is None or rule.symbol.match(sym.name) is not None):
+        with self.lock:
+          self.hits[i] += 1
+        return i
+    return None
+
+  def take_hits(self):
+    with self.lock:
+      hits = {'%s:%s' % (self.kind, rule.name) : n for rule, n in zip(self.rules, self.hits) if n}
+      self.hits = [0] * len(self.rules)
+    return hits
+
+class Rules:
+  def __init__(self, path):
+    try:
+      with open(path, 'rb') as f:
+        contents = f.read()
+      data = json.loads(contents.decode('utf-8'))
+    except (OSError, ValueError) as e:
+      raise Error("failed to load rules from %s: %s" % (path, e))
+    if not isinstance(data, dict) or set(data.keys()) - {'unresolved', 'duplicate'}:
+      raise Error("%s: expected object with 'unresolved' and 'duplicate' lists" % path)
+    self.unresolved = RuleList('unresolved', [Rule(r, path) for r in data.get('unresolved', [])])
+    self.duplicate = RuleList('duplicate', [Rule(r, path) for r in data.get('duplicate', [])])
+    # Identifies rules in caches of results
+    self.digest = hashlib.sha256(contents).hexdigest()
+    self.unresolved_masks = {}
+    self.classes = {}
+
+  def get_classes(self, obj):
+    classes = self.classes.get(obj.id)
+    if classes is None:
+      classes = self.classes[obj.id] = frozenset(cls for cls, pred in object_classes.items() if pred(obj.name))
+    return classes
+
+  def can_ignore_unresolved(self, sym, obj):
+    mask = self.unresolved_masks.get(obj.id)
+    if mask is None:
+      mask = 0
+      for i, rule in enumerate(self.unresolved.rules):
+        if rule.matches_object(obj):
+          mask |= 1 << i
+      self.unresolved_masks[obj.id] = mask
+    return mask != 0 and self.unresolved.find(sym, mask) is not None
+
+  # Returns mask of duplicate rules which apply to pair of objects
+  # (to be passed to can_ignore_duplicate)
+  def get_duplicate_mask(self, obj, other_obj):
+    classes = self.get_classes(obj)
+    other_classes = self.get_classes(other_obj)
+    mask = 0
+    for i, rule in enumerate(self.duplicate.rules):
+      if rule.matches_pair(obj, other_obj, classes, other_classes):
+        mask |= 1 << i
+    return mask
+
+  def can_ignore_duplicate(self, sym, mask):
+    return mask != 0 and self.duplicate.find(sym, mask) is not None
+
+  # Returns dict 'kind:rule name' -> number of hits since last call
+  def take_hits(self):
+    hits = self.unresolved.take_hits()
+    hits.update(self.duplicate.take_hits())
+    return hits
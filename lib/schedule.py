@@ -0,0 +1,56 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Ordering of packages by estimated cost: expensive packages are started
+# first so that they do not end up in the tail of the run
+# (longest-processing-time-first scheduling).
+
+import os
+import os.path
+import json
+import tempfile
+
+from lib.errors import warn
+
+# Returns dict package name -> time it took to process it in previous run
+def load_timings(path):
+  try:
+    with open(path, 'r') as f:
+      timings = json.load(f)
+  except FileNotFoundError:
+    return {}
+  except (OSError, ValueError) as e:
+    warn("failed to load timings from %s: %s" % (path, e))
+    return {}
+  if not isinstance(timings, dict):
+    warn("%s: expected object with package timings" % path)
+    return {}
+  return timings
+
+def save_timings(path, timings):
+  dirname = os.path.dirname(os.path.abspath(path))
+  fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+  with os.fdopen(fd, 'w') as f:
+    json.dump({name : round(t, 6) for name, t in timings.items()}, f, indent=0, sort_keys=True)
+  os.replace(tmp, path)
+
+# Sorts tasks by decreasing cost(task). Tasks with unknown
+# (None) cost are assumed to have average cost.
+def order_by_cost(tasks, cost):
+  costs = [cost(task) for task in tasks]
+  known = [c for c in costs if c is not None]
+  default = sum(known) / len(known) if known else 0
+  costs = [default if c is None else c for c in costs]
+  order = sorted(range(len(tasks)), key=lambda i: costs[i], reverse=True)
+  return [tasks[i] for i in order]
+
+# Returns cost estimate from timings of previous run if available
+# (fallback estimates are in different units so they are not mixed)
+def get_cost_function(timings, fallback=None):
+  if timings or fallback is None:
+    return lambda pkg: timings.get(pkg.name)
+  return fallback
@@ -0,0 +1,206 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Outputs for analysis results. Workers collect results in private
+# buffers which are written to sink in batches under a lock.
+# Forked worker processes can not share sink (and its record of already
+# reported findings) so their buffers are deferred: items are handed
+# to parent process which writes them.
+
+import sys
+import json
+import threading
+
+from lib import database
+from lib import errors
+
+DUPLICATE = 'duplicate'
+UNRESOLVED = 'unresolved'
+NO_SONAME = 'no-soname'
+
+class Sink:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.reported = set()
+    self.obj_name_ids = {}
+
+  def buffer(self, max_items=1000, defer=False):
+    return SinkBuffer(self, max_items, defer)
+
+  # Checks that finding was not reported before (must be called
+  # under lock). Duplicates are reported once for same pair
+  # of object names (in any order); to save memory this is tracked
+  # via IDs of names.
+  def is_new(self, kind, key):
+    if kind == DUPLICATE:
+      name_id, name, other_name = key
+      a = self.obj_name_ids.setdefault(name, len(self.obj_name_ids))
+      b = self.obj_name_ids.setdefault(other_name, len(self.obj_name_ids))
+      key = (name_id, a, b) if a < b else (name_id, b, a)
+    elif kind != NO_SONAME:
+      return True
+    if key in self.reported:
+      return False
+    self.reported.add(key)
+    return True
+
+  # Writes list of (kind, key, formatted item)
+  def write(self, items):
+    with self.lock:
+      self.write_items([item for kind, key, item in items if self.is_new(kind, key)])
+
+  def close(self):
+    pass
+
+# Same format as original print/warn output
+class TextSink(Sink):
+  def __init__(self, path=None):
+    Sink.__init__(self)
+    if path is None:
+      self.out, self.err = sys.stdout, sys.stderr
+    else:
+      self.out = self.err = open(path, 'w')
+
+  def format(self, kind, pkg, pkg_obj, sym, obj, other_obj):
+    if kind == DUPLICATE:
+      return False, "Duplicate definition of symbol '%s' in modules %s (from package %s) and %s (from package %s) (when loading object %s in package %s)\n" \
+        % (sym.name, other_obj.name, other_obj.pkg.source_name, obj.name, obj.pkg.source_name, pkg_obj.name, pkg.name)
+    if kind == UNRESOLVED:
+      msg = "unresolved reference to symbol '%s' in library %s (from package %s) (when loading object %s in package %s)" \
+        % (sym.name, obj.name, obj.pkg.source_name, pkg_obj.name, pkg.name)
+    else:
+      msg = "library %s does not have a SONAME" % obj.name
+    return True, '%s: warning: %s\n' % (errors.prog_name, msg)
+
+  def write_items(self, items):
+    self.out.write(''.join(line for is_warning, line in items if not is_warning))
+    self.out.flush()
+    self.err.write(''.join(line for is_warning, line in items if is_warning))
+    self.err.flush()
+
+  def close(self):
+    if self.out is not sys.stdout:
+      self.out.close()
+
+# One JSON object per line
+class JsonlSink(Sink):
+  def __init__(self, path=None):
+    Sink.__init__(self)
+    self.out = sys.stdout if path is None else open(path, 'w')
+
+  def format(self, kind, pkg, pkg_obj, sym, obj, other_obj):
+    record = {
+      'kind' : kind,
+      'package' : pkg.name,
+      'object' : pkg_obj.name if pkg_obj is not None else None,
+      'library' : obj.name,
+      'library_package' : obj.pkg.source_name,
+    }
+    if sym is not None:
+      record['symbol'] = sym.name
+    if other_obj is not None:
+      record['other_library'] = other_obj.name
+      record['other_library_package'] = other_obj.pkg.source_name
+    return json.dumps(record) + '\n'
+
+  def write_items(self, items):
+    self.out.write(''.join(items))
+    self.out.flush()
+
+  def close(self):
+    if self.out is not sys.stdout:
+      self.out.close()
+
+# Results are stored as IDs (symbol names can be found in SymbolNames)
+class DbSink(Sink):
+  columns = ('Kind', 'PackageID', 'ObjectID', 'LibID', 'OtherLibID', 'NameID')
+
+  def __init__(self, db):
+    Sink.__init__(self)
+    self.db = db
+    self.conn = None
+    conn = db.connect()
+    with conn as cur:
+      cur.execute('CREATE TABLE IF NOT EXISTS Findings (Kind VARCHAR(16), PackageID INT UNSIGNED, ObjectID INT UNSIGNED, LibID INT UNSIGNED, OtherLibID INT UNSIGNED, NameID BIGINT)')
+      cur.execute('DELETE FROM Findings')
+    conn.close()
+
+  def format(self, kind, pkg, pkg_obj, sym, obj, other_obj):
+    return (kind, pkg.id, pkg_obj.id if pkg_obj is not None else None, obj.id,
+            other_obj.id if other_obj is not None else None,
+            sym.name_id if sym is not None else None)
+
+  def write_items(self, items):
+    if self.conn is None:
+      self.conn = self.db.connect()
+    with self.conn as cur:
+      database.insert_rows(cur, 'Findings', self.columns, items)
+
+  def close(self):
+    if self.conn is not None:
+      self.conn.close()
+      self.conn = None
+
+formats = ['text', 'jsonl', 'db']
+
+def open_sink(fmt, path, db):
+  if fmt == 'text':
+    return TextSink(path)
+  elif fmt == 'jsonl':
+    return JsonlSink(path)
+  elif fmt == 'db':
+    return DbSink(db)
+  raise ValueError("unknown output format '%s'" % fmt)
+
+# Items are deduplicated when they are written to sink. Deferred buffers
+# (used in worker processes) are never written, instead items should be
+# collected via take() (e.g. after each chunk of packages)
+# and written by parent process.
+class SinkBuffer:
+  __slots__ = ['sink', 'items', 'max_items', 'defer', 'seen', 'max_seen']
+
+  def __init__(self, sink, max_items, defer, max_seen=100000):
+    self.sink = sink
+    self.items = []
+    self.max_items = max_items
+    self.defer = defer
+    # Local filter of repeated duplicates
+    # (same pair of libraries is checked for many executables)
+    self.seen = set()
+    self.max_seen = max_seen
+
+  def duplicate(self, pkg, pkg_obj, sym, obj, other_obj):
+    key = (sym.name_id, obj.name, other_obj.name)
+    if key not in self.seen:
+      if len(self.seen) >= self.max_seen:
+        # Forgetting keys only causes duplicate (ignored) items
+        self.seen.clear()
+      self.seen.add(key)
+      self.add(DUPLICATE, key, pkg, pkg_obj, sym, obj, other_obj)
+
+  def unresolved(self, pkg, pkg_obj, sym, obj):
+    self.add(UNRESOLVED, None, pkg, pkg_obj, sym, obj, None)
+
+  def no_soname(self, pkg, obj):
+    self.add(NO_SONAME, (pkg.id, obj.id), pkg, None, None, obj, None)
+
+  def add(self, kind, key, pkg, pkg_obj, sym, obj, other_obj):
+    self.items.append((kind, key, self.sink.format(kind, pkg, pkg_obj, sym, obj, other_obj)))
+    if len(self.items) >= self.max_items and not self.defer:
+      self.flush()
+
+  def flush(self):
+    if self.items and not self.defer:
+      self.sink.write(self.items)
+      self.items = []
+      self.seen.clear()
+
+  # Filter of duplicates is kept because items are not deduplicated
+  # until parent writes them
+  def take(self):
+    items, self.items = self.items, []
+    return items
@@ -0,0 +1,115 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Compact storage of symbols of an object. Instead of a Python object
+# per symbol, names are concatenated into a single UTF-8 blob and other
+# attributes are kept in parallel arrays (~13 bytes per symbol
+# plus name vs. ~200 bytes for Symbol objects).
+#
+# Symbol objects are created on demand (e.g. for reporting).
+
+from array import array
+
+import sys
+
+from lib.model import Symbol
+
+# Name strings may contain surrogates (e.g. produced by
+# surrogateescape) so use encoding which preserves them
+def encode_name(name):
+  return name.encode('utf-8', errors='surrogatepass')
+
+def decode_name(data):
+  return data.decode('utf-8', errors='surrogatepass')
+
+class SymbolTable:
+  __slots__ = ['obj', 'names', 'offsets', 'flags', 'name_ids']
+
+  def __init__(self, obj=None):
+    self.obj = obj
+    self.names = bytearray()
+    # Name of i-th symbol is names[offsets[i]:offsets[i + 1]]
+    self.offsets = array('I', [0])
+    # Combination of Symbol.WEAK and Symbol.PROTECTED
+    self.flags = bytearray()
+    # IDs of names in SymbolNames table (if known)
+    self.name_ids = array('q')
+
+  def add(self, name, flags, name_id=None):
+    self.add_encoded(encode_name(name), flags, name_id)
+
+  def add_encoded(self, data, flags, name_id=None):
+    self.names += data
+    self.offsets.append(len(self.names))
+    self.flags.append(flags)
+    if name_id is not None:
+      self.name_ids.append(name_id)
+
+  def __len__(self):
+    return len(self.flags)
+
+  def name(self, i):
+    return decode_name(self.names[self.offsets[i]:self.offsets[i + 1]])
+
+  def is_weak(self, i):
+    return bool(self.flags[i] & Symbol.WEAK)
+
+  # Returns Symbol for i-th entry
+  def __getitem__(self, i):
+    flags = self.flags[i]
+    sym = Symbol(self.name(i), self.obj, bool(flags & Symbol.WEAK), bool(flags & Symbol.PROTECTED))
+    if self.name_ids:
+      sym.name_id = self.name_ids[i]
+    return sym
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  # Iterates over (name, flags) pairs without creating Symbols
+  def rows(self):
+    names = bytes(self.names)
+    offsets = self.offsets
+    for i, flags in enumerate(self.flags):
+      yield decode_name(names[offsets[i]:offsets[i + 1]]), flags
+
+  def __repr__(self):
+    return repr(list(self))
+
+  # Returns table which shares symbols with this one
+  # (so neither of them may be modified afterwards)
+  def copy(self):
+    other = SymbolTable()
+    other.names = self.names
+    other.offsets = self.offsets
+    other.flags = self.flags
+    other.name_ids = self.name_ids
+    return other
+
+  # Releases memory reserved for further additions
+  def freeze(self):
+    self.names = bytes(self.names)
+    self.flags = bytes(self.flags)
+
+  # Memory footprint
+  def nbytes(self):
+    return sys.getsizeof(self) + sys.getsizeof(self.names) + sys.getsizeof(self.offsets) \
+      + sys.getsizeof(self.flags) + sys.getsizeof(self.name_ids)
+
+  # Serialization (for caches)
+  def __getstate__(self):
+    return bytes(self.names), self.offsets.tobytes(), bytes(self.flags), self.name_ids.tobytes()
+
+  def __setstate__(self, state):
+    names, offsets, flags, name_ids = state
+    self.obj = None
+    self.names = names
+    self.offsets = array('I')
+    self.offsets.frombytes(offsets)
+    self.flags = flags
+    self.name_ids = array('q')
+    self.name_ids.frombytes(name_ids)
@@ -0,0 +1,126 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2018 Yury Gribov
+# 
+# Use of this source code is governed by The MIT License (MIT)
+# that can be found in the LICENSE.txt file.
+
+# Tracing of program phases in Chrome trace-event format
+# (can be viewed in Perfetto or chrome://tracing).
+#
+# Usage:
+#   with trace.span('parse', file=f):
+#     ...
+#
+# When tracing is disabled span() returns a shared no-op object.
+# Worker processes dump their events to part files (PATH.PID.part)
+# which are merged into PATH by finish().
+
+import os
+import functools
+import glob
+import json
+import time
+import threading
+
+tracer = None
+
+class NullSpan:
+  __slots__ = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    return False
+
+null_span = NullSpan()
+
+class Span:
+  __slots__ = ['name', 'cat', 'args', 'start']
+
+  def __init__(self, name, cat, args):
+    self.name = name
+    self.cat = cat
+    self.args = args
+
+  def __enter__(self):
+    self.start = time.perf_counter_ns()
+    return self
+
+  def __exit__(self, *args):
+    end = time.perf_counter_ns()
+    tracer.add_span(self, end)
+    return False
+
+class Tracer:
+  def __init__(self, path):
+    self.path = path
+    self.events = []
+    self.thread_ids = set()
+
+  def add_span(self, span, end):
+    pid = os.getpid()
+    tid = threading.get_native_id()
+    if (pid, tid) not in self.thread_ids:
+      self.thread_ids.add((pid, tid))
+      self.events.append({'ph' : 'M', 'name' : 'thread_name', 'pid' : pid, 'tid' : tid,
+                          'args' : {'name' : threading.current_thread().name}})
+    self.events.append({'ph' : 'X', 'name' : span.name, 'cat' : span.cat, 'pid' : pid, 'tid' : tid,
+                        'ts' : span.start / 1000., 'dur' : (end - span.start) / 1000., 'args' : span.args})
+
+  # Events of forked processes are kept in part files
+  def flush(self):
+    pid = os.getpid()
+    events, self.events = self.events, []
+    events = [e for e in events if e['pid'] == pid]
+    if not events:
+      return
+    with open('%s.%d.part' % (self.path, pid), 'a') as f:
+      for e in events:
+        f.write(json.dumps(e))
+        f.write('\n')
+
+  def finish(self):
+    self.flush()
+    events = []
+    for part in sorted(glob.glob(glob.escape(self.path) + '.*.part')):
+      with open(part) as f:
+        events += [json.loads(line) for line in f]
+      os.unlink(part)
+    with open(self.path, 'w') as f:
+      json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, f)
+
+def enable(path):
+  global tracer
+  tracer = Tracer(path)
+  # Remove leftovers of previous runs
+  for part in glob.glob(glob.escape(path) + '.*.part'):
+    os.unlink(part)
+
+def span(name, cat='', **args):
+  if tracer is None:
+    return null_span
+  return Span(name, cat, args)
+
+# Decorator for tracing whole function
+def traced(name, cat=''):
+  def decorate(fun):
+    @functools.wraps(fun)
+    def wrapper(*args, **kwargs):
+      if tracer is None:
+        return fun(*args, **kwargs)
+      with Span(name, cat, {}):
+        return fun(*args, **kwargs)
+    return wrapper
+  return decorate
+
+# Called by worker processes once they are done with a chunk of work
+def flush():
+  if tracer is not None:
+    tracer.flush()
+
+# Writes trace file (must be called by main process)
+def finish():
+  if tracer is not None:
+    tracer.finish()